@@ -1,51 +1,156 @@
 from groq import Groq
 import os
+import re
 import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
+from atomic import atomic_write
 
 API_KEY = os.getenv("GROQ_API_KEY")
+# set to a local server to test against a fake completion endpoint
+BASE_URL = os.getenv("GROQ_BASE_URL")
 
-client = Groq(
-    api_key=API_KEY
-)
+# every answer is kept here so reruns only ask about new rules
+CACHE_PATH = '.cache/cwe.json'
 
+SYSTEM_PROMPT = "You are a cybersecurity expert specializing in static code analysis and vulnerability mapping. Your role is to accurately map warnings from static analysis tools (CodeQL, PMD, SpotBugs, Semgrep) to their corresponding CWE (Common Weakness Enumeration) IDs in the format 'CWE-xxxx'.\n\nWhen given a warning, identify the most relevant CWE ID and provide a brief explanation for your mapping decision. Ensure your responses are concise, accurate, and align with standard cybersecurity practices. If the warning is ambiguous, suggest the closest matching CWE ID based on the provided context.\n\nYour output should only contain CWE-xxx without any irrelevant messages."
 
-def update_cwe_ids(csv_filepath):
+BATCH_PROMPT = "\n\nYou may be given several warnings, one per line. Then answer with one line per warning in the same order, formatted as '<warning>: CWE-xxx'."
+
+
+class RateLimiter:
+    """ Spaces out request starts so at most `per_minute` start in any minute """
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class CweCache:
+    """ rule -> CWE answers on disk, saved after every batch so a crash loses nothing, unknown answers are asked again """
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='UTF-8') as f:
+                self.cwes = json.load(f)
+        except (OSError, ValueError):
+            self.cwes = {}
+
+    def get(self, rule):
+        cwe = self.cwes.get(rule)
+        # caches written before unknown answers were left out may still hold them
+        return None if cwe == 'CWE-unknown' else cwe
+
+    def update(self, answers: dict):
+        with self.lock:
+            self.cwes.update((rule, cwe) for rule, cwe in answers.items() if cwe != 'CWE-unknown')
+            with atomic_write(self.path, encoding='UTF-8') as f:
+                json.dump(self.cwes, f, indent=2, sort_keys=True)
+
+
+def make_client():
+    return Groq(api_key=API_KEY, base_url=BASE_URL)
+
+def _parse_cwe(text: str):
+    if text.startswith('CWE-'):
+        return text
+    return 'CWE-unknown'
+
+""" Ask for the CWE of each rule in one request """
+def ask_cwes(client, rules: list):
+    system = SYSTEM_PROMPT if len(rules) == 1 else SYSTEM_PROMPT + BATCH_PROMPT
+    completion = client.chat.completions.create(
+        model="llama-3.1-70b-versatile",
+        messages=[
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": "\n".join(rules)
+            },
+        ],
+        temperature=0.5,
+        max_tokens=1024,
+        top_p=0.65,
+        stream=False,
+        stop=None,
+    )
+    content = completion.choices[0].message.content
+    if len(rules) == 1:
+        return {rules[0]: _parse_cwe(content)}
+
+    answers = {rule: 'CWE-unknown' for rule in rules}
+    for line in content.splitlines():
+        rule, sep, cwe = line.rpartition(':')
+        # models like to number or bullet their lines and quote the rule
+        rule = re.sub(r'^\s*(?:\d+[.)]|[-*])\s*', '', rule).strip().strip('`\'"')
+        match = re.search(r'CWE-\d+', cwe)
+        if sep and rule in answers and match:
+            answers[rule] = match.group()
+    return answers
+
+def update_cwe_ids(csv_filepath, client=None, workers: int = 4, batch_size: int = 10, per_minute: float = 30, cache=None):
     with open(csv_filepath, mode='r') as file:
         reader = csv.DictReader(file)
         rows = list(reader)
 
-    for row in tqdm(rows, desc="Updating CWE IDs"):
-        if row['cwe'] == 'CWE-unknown':
-            rule = row['id']
-            completion = client.chat.completions.create(
-                model="llama-3.1-70b-versatile",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a cybersecurity expert specializing in static code analysis and vulnerability mapping. Your role is to accurately map warnings from static analysis tools (CodeQL, PMD, SpotBugs, Semgrep) to their corresponding CWE (Common Weakness Enumeration) IDs in the format 'CWE-xxxx'.\n\nWhen given a warning, identify the most relevant CWE ID and provide a brief explanation for your mapping decision. Ensure your responses are concise, accurate, and align with standard cybersecurity practices. If the warning is ambiguous, suggest the closest matching CWE ID based on the provided context.\n\nYour output should only contain CWE-xxx without any irrelevant messages."
-                    },
-                    {
-                        "role": "user",
-                        "content": rule
-                    },
-                ],
-                temperature=0.5,
-                max_tokens=1024,
-                top_p=0.65,
-                stream=False,
-                stop=None,
-            )
-            cwe_id = 'CWE-unknown'
-            got_cwe_id = completion.choices[0].message.content
-            if got_cwe_id.startswith('CWE-'):
-                cwe_id = got_cwe_id
-            row['cwe'] = cwe_id
+    cache = cache or CweCache()
+    unknown = [row['id'] for row in rows if row['cwe'] == 'CWE-unknown']
+    to_ask = list(dict.fromkeys(rule for rule in unknown if cache.get(rule) is None))
+    batches = [to_ask[i:i + batch_size] for i in range(0, len(to_ask), batch_size)]
+    print(f"{len(unknown)} unknown rules, {len(unknown) - len(to_ask)} cached, asking about {len(to_ask)}")
+
+    if batches:
+        client = client or make_client()
+        limiter = RateLimiter(per_minute)
+
+        def resolve(batch):
+            limiter.wait()
+            answers = ask_cwes(client, batch)
+            cache.update(answers)
+            return len(batch)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=len(to_ask), desc="Updating CWE IDs") as bar:
+            futures = {executor.submit(resolve, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    bar.update(future.result())
+                except Exception as e:
+                    tqdm.write(f"Error asking about {futures[future]}: {e}")
+                    errors.append(e)
+        if errors:
+            print(f"{len(errors)} batches failed, rerun to retry them")
+
+    for row in rows:
+        if row['cwe'] == 'CWE-unknown' and cache.get(row['id']) is not None:
+            row['cwe'] = cache.get(row['id'])
 
     with open(csv_filepath, mode='w', newline='') as file:
         writer = csv.DictWriter(file, fieldnames=reader.fieldnames)
         writer.writeheader()
         writer.writerows(rows)
 
-update_cwe_ids(Path('./rules.csv').absolute())
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4, help='concurrent requests')
+    parser.add_argument('--batch-size', type=int, default=10, help='rules asked about per request')
+    parser.add_argument('--per-minute', type=float, default=30, help='maximum requests started per minute')
+    args = parser.parse_args()
+    update_cwe_ids(Path('./rules.csv').absolute(), workers=args.workers, batch_size=args.batch_size, per_minute=args.per_minute)
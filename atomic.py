@@ -0,0 +1,17 @@
+""" Files written aside and renamed into place, so readers and parallel jobs never see a partial file """
+import os
+import threading
+from contextlib import contextmanager
+
+""" Open a temporary file next to path, it replaces path only if the block completes """
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', encoding: str = None):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
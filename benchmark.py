@@ -0,0 +1,195 @@
+""" Synthetic SARIF in the shape each tool writes, plus timings of every pipeline stage """
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from compare import load_sarifs, get_real_warnings
+from uniform import uniform_warnings, Encoder
+from merge import MergedWarnings, merge_report
+from rule import RULE_FUNC
+
+def make_rule(tool: str, index: int, rng: random.Random):
+    rule_id = f'{tool}/rule-{index}'
+    cwe = rng.randint(1, 1000)
+    rule = {
+        'id': rule_id,
+        'shortDescription': {'text': f'Synthetic {tool} rule {index}'},
+        'properties': {'tags': []},
+    }
+    if tool == 'codeql':
+        rule['properties']['tags'] = ['correctness', f'external/cwe/cwe-{cwe:03d}']
+    elif tool == 'semgrep':
+        rule['properties']['tags'] = [f'CWE-{cwe}: synthetic weakness']
+    elif tool == 'spotbugs' and index % 2 == 0:
+        rule['relationships'] = [{'target': {'id': str(cwe)}}]
+    return rule
+
+def make_result(issue: dict):
+    return {
+        'ruleId': issue['rule'],
+        'message': {'text': issue['message']},
+        'locations': [
+            {
+                'physicalLocation': {
+                    'artifactLocation': {'uri': issue['uri'], 'uriBaseId': '%SRCROOT%'},
+                    'region': {
+                        'startLine': issue['line'],
+                        'startColumn': issue['column'],
+                        'endColumn': issue['column'] + 10,
+                    },
+                }
+            }
+        ],
+    }
+
+def make_sarif(tool: str, rules: list, issues: list):
+    return {
+        'version': '2.1.0',
+        'runs': [
+            {
+                'tool': {'driver': {'name': tool, 'rules': rules}},
+                'results': [make_result(issue) for issue in issues],
+            }
+        ],
+    }
+
+""" Issues of every tag, each tag drifts, fixes and adds some of the previous tag's issues """
+def make_tags(tool: str, results: int, tags: int, rules: int, drift: float, fix: float, rng: random.Random):
+    files = max(1, results // 20)
+
+    def new_issue():
+        file = rng.randrange(files)
+        rule = rng.randrange(rules)
+        return {
+            'rule': f'{tool}/rule-{rule}',
+            'uri': f'src/main/java/org/example/p{file % 50}/File{file}.java',
+            'line': rng.randint(1, 2000),
+            'column': rng.randint(1, 40),
+            'message': f'Synthetic {tool} rule {rule} finding {rng.randrange(5)}',
+        }
+
+    issues = [new_issue() for _ in range(results)]
+    all_tags = [issues]
+    for _ in range(1, tags):
+        next_issues = []
+        for issue in all_tags[-1]:
+            if rng.random() < fix:
+                continue
+            issue = dict(issue)
+            if rng.random() < drift:
+                # some drifts stay inside the 100 line window, some break the trace
+                issue['line'] = max(1, issue['line'] + rng.randint(-150, 150))
+            next_issues.append(issue)
+        next_issues += [new_issue() for _ in range(results - len(next_issues))]
+        all_tags.append(next_issues)
+    return all_tags
+
+""" Write repos/{repo}/tag_{n}/{repo}-{n}/{tool}.sarif under root, returns bytes written """
+def generate(root: str, repo: str, tools: list, results: int, tags: int, rules: int, drift: float, fix: float, seed: int):
+    rng = random.Random(seed)
+    size = 0
+    for tool in tools:
+        tool_rules = [make_rule(tool, i, rng) for i in range(rules)]
+        for n, issues in enumerate(make_tags(tool, results, tags, rules, drift, fix, rng), start=1):
+            tag_dir = os.path.join(root, 'repos', repo, f'tag_{n}', f'{repo}-{n}')
+            os.makedirs(tag_dir, exist_ok=True)
+            path = os.path.join(tag_dir, f'{tool}.sarif')
+            with open(path, 'w', encoding='UTF-8') as f:
+                json.dump(make_sarif(tool, tool_rules, issues), f, indent=2)
+            size += os.path.getsize(path)
+    return size
+
+@contextmanager
+def cwd(path: str):
+    original = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(original)
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+def run(root: str, repo: str, tools: list):
+    timer = Timer()
+    counts = {}
+    reports = {}
+    with cwd(root):
+        with timer.stage('rules'):
+            all_rules = {'tool': [], 'id': [], 'cwe': []}
+            for tool in tools:
+                RULE_FUNC[tool](all_rules)
+        # every rule is known so uniform does the full work for every warning
+        cwes = dict(zip(all_rules['id'], all_rules['cwe']))
+
+        for tool in tools:
+            with timer.stage('load_sarifs_cold'):
+                load_sarifs(repo, tool)
+            with timer.stage('load_sarifs'):
+                sarifs = load_sarifs(repo, tool)
+            with timer.stage('get_real_warnings'):
+                real_warnings = get_real_warnings(sarifs, progress=False)
+            with timer.stage('uniform'):
+                uni_warnings, _ = uniform_warnings(real_warnings, tool, cwes)
+            reports[tool] = json.loads(json.dumps(uni_warnings, cls=Encoder))
+            counts[tool] = {
+                'warnings': len(sarifs[0].results),
+                'real_warnings': len(real_warnings),
+            }
+
+        with timer.stage('merge'):
+            merged = MergedWarnings()
+            for tool in tools:
+                merge_report(merged, reports[tool], tool)
+        counts['merged'] = len(merged.warnings)
+    return timer.stages, counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic SARIF')
+    parser.add_argument('--results', type=int, default=1000, help='results per tag and tool')
+    parser.add_argument('--tags', type=int, default=5)
+    parser.add_argument('--rules', type=int, default=50, help='rules per tool')
+    parser.add_argument('--drift', type=float, default=0.1, help='share of results whose line moves in each tag')
+    parser.add_argument('--fix', type=float, default=0.05, help='share of results that disappear in each tag')
+    parser.add_argument('--tools', nargs='+', default=['codeql', 'pmd', 'spotbugs'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append the results as one JSON line to this file')
+    args = parser.parse_args()
+
+    # rule.load_raw_rule reads commons-io, so the synthetic repo takes its name
+    repo = 'commons-io'
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        size = generate(root, repo, args.tools, args.results, args.tags, args.rules, args.drift, args.fix, args.seed)
+        generate_time = time.perf_counter() - start
+        stages, counts = run(root, repo, args.tools)
+
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'config': vars(args),
+        'sarif_bytes': size,
+        'generate': generate_time,
+        'stages': stages,
+        'counts': counts,
+    }
+    line = json.dumps(record)
+    print(line)
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(line + '\n')
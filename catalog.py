@@ -0,0 +1,110 @@
+""" Rule catalog of every SARIF under repos/, merged into rules.csv and indexed for fast loading """
+import argparse
+import csv
+import glob
+import os
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from sarif import load_rules
+from rule import RULE_CWE, tools
+from atomic import atomic_write
+
+RULES_CSV = 'rules.csv'
+# rule id -> CWE of rules.csv, rebuilt whenever rules.csv changes
+INDEX_PATH = '.cache/rules.index'
+INDEX_VERSION = 1
+
+def tag_number(path: str):
+    match = re.search(r'/tag_(\d+)/', path)
+    return int(match.group(1)) if match else 0
+
+""" SARIF files of every repo, tag and tool, in a stable order """
+def list_sarif_files(tools=tools):
+    paths = []
+    for tool in tools:
+        files = glob.glob(f'repos/*/tag_*/*/{tool}.sarif')
+        files.sort(key=lambda path: (path.split('/')[1], tag_number(path), path))
+        paths += [(tool, path) for path in files]
+    return paths
+
+""" (id, CWE) of each rule of one SARIF file """
+def scan_rules(tool: str, path: str):
+    return [(rule['id'], RULE_CWE[tool](rule)) for rule in load_rules(path)]
+
+""" Rules of all SARIF files, first seen wins but a known CWE replaces CWE-unknown """
+def build_catalog(workers: int = None, tools=tools):
+    paths = list_sarif_files(tools)
+    catalog = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        scanned = executor.map(scan_rules, [tool for tool, _ in paths], [path for _, path in paths], chunksize=4)
+        for (tool, _), rules in zip(paths, scanned):
+            for rule_id, cwe in rules:
+                entry = catalog.setdefault(rule_id, [tool, cwe])
+                if entry[1] == 'CWE-unknown':
+                    entry[1] = cwe
+    return len(paths), catalog
+
+""" Add new rules of the catalog to rules.csv, rows already there keep their CWE unless it is unknown """
+def merge_into_csv(catalog: dict, csv_path: str = RULES_CSV):
+    rows = []
+    if os.path.exists(csv_path):
+        with open(csv_path, mode='r', newline='') as file:
+            rows = list(csv.DictReader(file))
+    known = set()
+    updated = 0
+    for row in rows:
+        known.add(row['id'])
+        entry = catalog.get(row['id'])
+        if entry and row['cwe'] == 'CWE-unknown' and entry[1] != 'CWE-unknown':
+            row['cwe'] = entry[1]
+            updated += 1
+    added = [
+        {'tool': tool, 'id': rule_id, 'cwe': cwe}
+        for rule_id, (tool, cwe) in catalog.items() if rule_id not in known
+    ]
+    with open(csv_path, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['tool', 'id', 'cwe'])
+        writer.writeheader()
+        writer.writerows(rows + added)
+    return len(added), updated
+
+def _stamp(csv_path: str):
+    stat = os.stat(csv_path)
+    return (os.path.abspath(csv_path), stat.st_size, stat.st_mtime_ns)
+
+def write_index(cwes: dict, stamp, index_path: str = INDEX_PATH):
+    with atomic_write(index_path, 'wb') as f:
+        pickle.dump({'version': INDEX_VERSION, 'stamp': stamp, 'cwes': cwes}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+""" rule_cwes of rules.csv, from the index while rules.csv is unchanged """
+def load_cwes(csv_path: str = RULES_CSV, index_path: str = INDEX_PATH):
+    stamp = _stamp(csv_path)
+    try:
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+        if index.get('version') == INDEX_VERSION and index.get('stamp') == stamp:
+            return index['cwes']
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    import pandas as pd
+    from uniform import rule_cwes
+    rules = pd.read_csv(csv_path)
+    rules.set_index('id', inplace=True)
+    cwes = rule_cwes(rules)
+    write_index(cwes, stamp, index_path)
+    return cwes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', '-j', type=int, help='processes reading SARIF files, defaults to one per CPU')
+    parser.add_argument('--tools', nargs='+', default=tools)
+    args = parser.parse_args()
+
+    files, catalog = build_catalog(args.jobs, args.tools)
+    added, updated = merge_into_csv(catalog)
+    load_cwes()
+    unknown = sum(cwe == 'CWE-unknown' for _, cwe in catalog.values())
+    print(f'{len(catalog)} rules in {files} SARIF files, {unknown} without a CWE')
+    print(f'Added {added} rules to {RULES_CSV}, filled the CWE of {updated}, run inferCWE.py or askCWE.py for the rest')
@@ -0,0 +1,132 @@
+import numpy as np
+
+# uniform.Warning fields, in the order Encoder writes them
+STRING_COLUMNS = ['type', 'cwe', 'message', 'file']
+INT_COLUMNS = ['start_line', 'end_line', 'start_column', 'end_column']
+COLUMNS = ['type', 'cwe', 'message', 'file', 'start_line', 'end_line', 'start_column', 'end_column', 'flag', 'tag_history']
+
+def _encode_strings(arrays, name, values):
+    encoded = [v.encode('UTF-8') if isinstance(v, str) else b'' for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    arrays[f'{name}.data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays[f'{name}.offsets'] = offsets
+    arrays[f'{name}.null'] = np.array([not isinstance(v, str) for v in values], dtype=bool)
+
+def _encode_ints(arrays, name, values):
+    arrays[f'{name}.values'] = np.array([v if v is not None else 0 for v in values], dtype=np.int64)
+    arrays[f'{name}.null'] = np.array([v is None for v in values], dtype=bool)
+
+""" Save uniform warnings column by column, tag_history as offsets into flat columns """
+def write_columnar(path, warnings):
+    arrays = {'length': np.array(len(warnings), dtype=np.int64)}
+    for name in STRING_COLUMNS:
+        _encode_strings(arrays, name, [getattr(w, name) for w in warnings])
+    for name in INT_COLUMNS:
+        _encode_ints(arrays, name, [getattr(w, name) for w in warnings])
+    arrays['flag.values'] = np.array([bool(w.flag) for w in warnings], dtype=bool)
+
+    history = [trace for w in warnings for trace in w.tag_history]
+    offsets = np.zeros(len(warnings) + 1, dtype=np.int64)
+    np.cumsum([len(w.tag_history) for w in warnings], out=offsets[1:])
+    arrays['tag_history.offsets'] = offsets
+    _encode_strings(arrays, 'tag_history.file', [trace.file for trace in history])
+    _encode_ints(arrays, 'tag_history.line_number', [trace.line_number for trace in history])
+
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+class ColumnarReport:
+    """ A report written by write_columnar, arrays are read on first use and rows decoded one at a time """
+    def __init__(self, path):
+        self.npz = np.load(path)
+        self.arrays = {}
+        self.length = int(self._array('length'))
+        self.columns = {}
+
+    def __len__(self):
+        return self.length
+
+    def _array(self, key):
+        if key not in self.arrays:
+            self.arrays[key] = self.npz[key]
+        return self.arrays[key]
+
+    def _string(self, name, i):
+        if self._array(f'{name}.null')[i]:
+            return None
+        offsets = self._array(f'{name}.offsets')
+        return self._array(f'{name}.data')[offsets[i]:offsets[i + 1]].tobytes().decode('UTF-8')
+
+    def _int(self, name, i):
+        return None if self._array(f'{name}.null')[i] else int(self._array(f'{name}.values')[i])
+
+    def _strings(self, name):
+        data = self._array(f'{name}.data').tobytes()
+        offsets = self._array(f'{name}.offsets').tolist()
+        null = self._array(f'{name}.null').tolist()
+        return [
+            None if null[i] else data[offsets[i]:offsets[i + 1]].decode('UTF-8')
+            for i in range(len(null))
+        ]
+
+    def _ints(self, name):
+        values = self._array(f'{name}.values').tolist()
+        null = self._array(f'{name}.null').tolist()
+        return [None if is_null else value for value, is_null in zip(values, null)]
+
+    def column(self, name):
+        if name not in self.columns:
+            if name in STRING_COLUMNS:
+                self.columns[name] = self._strings(name)
+            elif name in INT_COLUMNS:
+                self.columns[name] = self._ints(name)
+            elif name == 'flag':
+                self.columns[name] = self._array('flag.values').tolist()
+            elif name == 'tag_history':
+                offsets = self._array('tag_history.offsets').tolist()
+                files = self._strings('tag_history.file')
+                lines = self._ints('tag_history.line_number')
+                self.columns[name] = [
+                    [
+                        {'file': files[j], 'line_number': lines[j]}
+                        for j in range(offsets[i], offsets[i + 1])
+                    ] for i in range(self.length)
+                ]
+            else:
+                raise KeyError(name)
+        return self.columns[name]
+
+    """ Value of one cell, from the decoded column if there is one """
+    def cell(self, name, i):
+        if name in self.columns:
+            return self.columns[name][i]
+        if name in STRING_COLUMNS:
+            return self._string(name, i)
+        if name in INT_COLUMNS:
+            return self._int(name, i)
+        if name == 'flag':
+            return bool(self._array('flag.values')[i])
+        if name == 'tag_history':
+            offsets = self._array('tag_history.offsets')
+            return [
+                {'file': self._string('tag_history.file', j), 'line_number': self._int('tag_history.line_number', j)}
+                for j in range(offsets[i], offsets[i + 1])
+            ]
+        raise KeyError(name)
+
+    """ Warning i as the dict json.load gives for warnings.json """
+    def row(self, i):
+        return {name: self.cell(name, i) for name in COLUMNS}
+
+    def rows(self):
+        return [{name: self.column(name)[i] for name in COLUMNS} for i in range(self.length)]
+
+    def close(self):
+        self.npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,82 +1,419 @@
-import json
 import os
 import re
 import glob
-import pandas as pd
+import argparse
+import pickle
+import time
+import cProfile
+import pstats
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bisect import bisect_left, bisect_right
 from tqdm import tqdm
-from warning import to_warning
-from uniform import uniform, Encoder
+from warning import to_warning, TraceEntry, LINE_WINDOW
+from uniform import uniform_warning, JsonArrayWriter
+from sarif import load_sarif, iter_results
+from spill import Partitions, partition_count, BUFFER_BYTES
+from catalog import load_cwes
+from columnar import write_columnar
+from metrics import JobMetrics, write_metrics, MATCHING_OUTCOMES
+from atomic import atomic_write
 
 repos = ['commons-io', 'commons-lang', 'opennlp', 'pdfbox', 'ratis']
 tools = ['codeql', 'pmd', 'spotbugs', 'semgrep']
 
+# saved traces for --incremental
+STATE_DIR = '.cache/traces'
+STATE_VERSION = 3
+
 # repos = ['commons-io']
 # tools = ['spotbugs']
 
+def tag_number(tag: str):
+    return int(re.findall(r'\d+', tag)[0])
+
 class SarifData:
     def __init__(self, path: str, tag: str, tool: str):
         self.path = path
-        self.tag = int(re.findall(r'\d+', tag)[0])
+        self.tag = tag_number(tag)
         self.tool = tool
 
-        with open(path, 'r', encoding='UTF-8') as f:
-            data = json.load(f)
-            self.results = data['runs'][0]['results']
-            self.rules = data['runs'][0]['tool']['driver']['rules']
+        self.size = os.path.getsize(path)
+        self.results, self.rules = load_sarif(path)
+        self.index = None
+        self.fingerprints = None
+        self.occurrences = None
 
-""" Load SARIF of all tags for a given repo and tool """
-def load_sarifs(repo, tool):
-    sarifs = []
+    """ SarifData over results that are already loaded, e.g. one partition of a tag """
+    @classmethod
+    def from_results(cls, tag: str, tool: str, results: list, path: str = None):
+        sarif = cls.__new__(cls)
+        sarif.path = path
+        sarif.tag = tag_number(tag)
+        sarif.tool = tool
+        sarif.size = 0
+        sarif.results = results
+        sarif.rules = None
+        sarif.index = None
+        sarif.fingerprints = None
+        sarif.occurrences = None
+        return sarif
+
+    """ Group results by exact-match key, each group sorted by start line """
+    def build_index(self):
+        groups = {}
+        self.fingerprints = {}
+        self.occurrences = {}
+        for i, result in enumerate(self.results):
+            trace = TraceEntry(result)
+            groups.setdefault(trace.match_key(), []).append((trace.start_line(), i))
+            if trace.fingerprint() is not None:
+                positions = self.fingerprints.setdefault(trace.fingerprint(), [])
+                self.occurrences[i] = len(positions)
+                positions.append(i)
+        self.index = {}
+        for key, entries in groups.items():
+            entries.sort()
+            lines = [line for line, _ in entries]
+            positions = [i for _, i in entries]
+            self.index[key] = (lines, positions)
+
+    """ Positions of the results that may match the trace, in file order """
+    def candidate_positions(self, trace):
+        if self.index is None:
+            self.build_index()
+        group = self.index.get(trace.match_key())
+        if group is None:
+            return []
+        lines, positions = group
+        line = trace.start_line()
+        lo = bisect_left(lines, line - LINE_WINDOW + 1)
+        hi = bisect_right(lines, line + LINE_WINDOW - 1)
+        return sorted(positions[lo:hi])
+
+    """ Position of the k-th result with the trace's fingerprint, None if there are fewer, like CodeQL's :N suffix """
+    def fingerprint_position(self, trace, occurrence: int = 0):
+        if self.index is None:
+            self.build_index()
+        positions = self.fingerprints.get(trace.fingerprint(), [])
+        return positions[occurrence] if occurrence < len(positions) else None
+
+    """ How many earlier results of this tag share the fingerprint of result i """
+    def occurrence(self, i: int):
+        if self.index is None:
+            self.build_index()
+        return self.occurrences.get(i, 0)
+
+    """ Results that may match the trace, in file order """
+    def candidates(self, trace):
+        return [self.results[i] for i in self.candidate_positions(trace)]
+
+""" Paths of the SARIF of all tags for a given repo and tool, sorted by tag """
+def list_sarifs(repo, tool):
+    paths = []
 
     base_path = f'repos/{repo}'
-    tags = os.listdir(base_path)
+    # only tag_N, not what else may sit next to them
+    tags = [tag for tag in os.listdir(base_path) if re.fullmatch(r'tag_\d+', tag)]
     assert len(tags) > 0 # at least one tag per repo
 
     for tag in tags:
         sarif_file = glob.glob(f'{base_path}/{tag}/*/{tool}.sarif')
         assert len(sarif_file) == 1 # only one sarif file per tool per tag
-        sarif_path = sarif_file[0]
-        sarifs.append(SarifData(sarif_path, tag, tool))
+        paths.append((tag, sarif_file[0]))
 
-    sarifs.sort(key=lambda x: x.tag)
-    return sarifs
+    paths.sort(key=lambda x: tag_number(x[0]))
+    return paths
 
-def get_real_warnings(sarifs):
-    real_warnings = []
-    base_results = sarifs[0].results
-    rules = sarifs[0].rules
-    for base_result in tqdm(base_results, desc='Processing warnings'):
-        warning = to_warning(base_result)
+""" Load SARIF of all tags for a given repo and tool """
+def load_sarifs(repo, tool):
+    return [SarifData(path, tag, tool) for tag, path in list_sarifs(repo, tool)]
+
+""" Warnings of the first tag, with fingerprint matching each knows which occurrence of its fingerprint it is """
+def first_warnings(sarif, matching='window'):
+    warnings = [to_warning(result) for result in sarif.results]
+    if matching != 'fingerprint':
+        return warnings
+    for i, warning in enumerate(warnings):
+        warning.occurrence = sarif.occurrence(i)
+    return warnings
+
+""" Follow a trace into the next tag by fingerprint, the window rule decides when there is none """
+def follow_fingerprint(warning, sarif, agreement):
+    trace = warning.trace[-1]
+    window = sarif.candidate_positions(trace)
+    window = window[0] if window else None
+    if trace.fingerprint() is None:
+        agreement['fallback'] += 1
+        match = window
+    else:
+        match = sarif.fingerprint_position(trace, warning.occurrence)
+        if match is not None and window is not None:
+            agreement['same' if match == window else 'different'] += 1
+        elif match is not None:
+            agreement['fingerprint_only'] += 1
+        elif window is not None:
+            agreement['window_only'] += 1
+        else:
+            agreement['neither'] += 1
+    if match is None:
+        return False
+    warning.add_trace(sarif.results[match])
+    warning.occurrence = sarif.occurrence(match)
+    return True
+
+""" Follow each warning through the given tags, returns those whose trace breaks """
+def follow_warnings(warnings, sarifs, progress=True, metrics=None, matching='window'):
+    broken = []
+    comparisons = 0
+    looked_up = [0] * len(sarifs)
+    matched = [0] * len(sarifs)
+    agreement = dict.fromkeys(MATCHING_OUTCOMES, 0)
+    for warning in tqdm(warnings, desc='Processing warnings', disable=not progress):
         # scan all tags
-        for sarif in sarifs[1:]:
+        for i, sarif in enumerate(sarifs):
             has_trace = False
-            for result in sarif.results:
-                if warning.try_add_trace(result):
-                    has_trace = True
-                    break
+            looked_up[i] += 1
+            if matching == 'fingerprint':
+                comparisons += 1
+                has_trace = follow_fingerprint(warning, sarif, agreement)
+            else:
+                for result in sarif.candidates(warning.trace[-1]):
+                    comparisons += 1
+                    if warning.try_add_trace(result):
+                        has_trace = True
+                        break
             if not has_trace:
-                real_warnings.append(warning)
+                broken.append(warning)
                 break
-    return real_warnings
+            matched[i] += 1
+    if metrics is not None:
+        metrics.comparisons += comparisons
+        if matching == 'fingerprint':
+            metrics.add_matching(agreement)
+        for sarif, n, m in zip(sarifs, looked_up, matched):
+            metrics.add_tag(sarif.tag, n, m)
+    return broken
 
-if __name__ == '__main__':
-    rules = pd.read_csv('rules.csv')
-    rules.set_index('id', inplace=True)
-    for repo in repos:
-        for tool in tools:
+def get_real_warnings(sarifs, progress=True, metrics=None, matching='window'):
+    warnings = first_warnings(sarifs[0], matching)
+    return follow_warnings(warnings, sarifs[1:], progress, metrics, matching)
+
+""" get_real_warnings within a memory limit: results of all tags are spilled to disk by URI and matched a partition at a time """
+def get_real_warnings_partitioned(repo, tool, memory_mb, progress=True, metrics=None, matching='window'):
+    metrics = metrics or JobMetrics(repo, tool)
+    paths = list_sarifs(repo, tool)
+    total = sum(os.path.getsize(path) for _, path in paths)
+    metrics.sarif_bytes += total
+    memory_bytes = memory_mb * 2 ** 20
+    count = partition_count(total, memory_bytes)
+    warnings = 0
+    real_warnings = []
+    # a quarter of the limit for write buffers, whatever the number of partitions
+    with Partitions(count, min(BUFFER_BYTES, memory_bytes // 4)) as partitions:
+        with metrics.stage('partition'):
+            for t, (_, path) in enumerate(tqdm(paths, desc='Partitioning tags', disable=not progress)):
+                for position, result in enumerate(iter_results(path)):
+                    partitions.add(t, position, result)
+                    warnings += t == 0
+            partitions.flush()
+
+        with metrics.stage('match'):
+            for p in tqdm(range(count), desc='Matching partitions', disable=not progress):
+                results = [[] for _ in paths]
+                positions = []
+                for t, position, result in partitions.read(p):
+                    results[t].append(result)
+                    if t == 0:
+                        positions.append(position)
+                # a trace only ever matches results with its own URI, so partitions are independent
+                sarifs = [SarifData.from_results(tag, tool, tag_results, path) for (tag, path), tag_results in zip(paths, results)]
+                partition_warnings = first_warnings(sarifs[0], matching)
+                position_of = {id(warning): position for warning, position in zip(partition_warnings, positions)}
+                for warning in follow_warnings(partition_warnings, sarifs[1:], False, metrics, matching):
+                    real_warnings.append((position_of[id(warning)], warning))
+    # back in the order of the first tag, as the in-memory path returns them
+    real_warnings.sort(key=lambda item: item[0])
+    return warnings, [warning for _, warning in real_warnings]
+
+def _sarif_stamp(tag, path):
+    stat = os.stat(path)
+    return (tag, path, stat.st_size, stat.st_mtime_ns)
+
+def _state_path(repo, tool):
+    return os.path.join(STATE_DIR, tool, f'{repo}.pickle')
+
+def save_state(repo, tool, stamps, warnings, matching='window'):
+    state = {
+        'version': STATE_VERSION,
+        'matching': matching,
+        'tags': stamps,
+        'traces': [[trace.data for trace in warning.trace] for warning in warnings],
+        'occurrences': [warning.occurrence for warning in warnings],
+    }
+    with atomic_write(_state_path(repo, tool), 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+""" Saved warnings and the number of tags they were traced through, None if the tags changed """
+def load_state(repo, tool, stamps, matching='window'):
+    try:
+        with open(_state_path(repo, tool), 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if state.get('version') != STATE_VERSION or state.get('matching') != matching:
+        return None
+    saved = [tuple(stamp) for stamp in state['tags']]
+    if len(saved) == 0 or saved != stamps[:len(saved)]:
+        return None
+    warnings = []
+    for trace, occurrence in zip(state['traces'], state['occurrences']):
+        warning = to_warning(trace[0])
+        for data in trace[1:]:
+            warning.trace.append(TraceEntry(data))
+        warning.occurrence = occurrence
+        warnings.append(warning)
+    return len(saved), warnings
+
+""" get_real_warnings that only matches the tags added since the last saved state """
+def get_real_warnings_incremental(repo, tool, progress=True, metrics=None, matching='window'):
+    metrics = metrics or JobMetrics(repo, tool)
+    with metrics.stage('load'):
+        paths = list_sarifs(repo, tool)
+        stamps = [_sarif_stamp(tag, path) for tag, path in paths]
+        state = load_state(repo, tool, stamps, matching)
+        if state is None:
+            sarifs = [SarifData(path, tag, tool) for tag, path in paths]
+            warnings = first_warnings(sarifs[0], matching)
+            alive, new_sarifs = warnings, sarifs[1:]
+        else:
+            done, warnings = state
+            sarifs = [SarifData(path, tag, tool) for tag, path in paths[done:]]
+            # a warning is still alive only if it was traced through every saved tag
+            alive = [warning for warning in warnings if len(warning.trace) == done]
+            new_sarifs = sarifs
+        metrics.sarif_bytes += sum(sarif.size for sarif in sarifs)
+    with metrics.stage('match'):
+        follow_warnings(alive, new_sarifs, progress, metrics, matching)
+    with metrics.stage('save_state'):
+        save_state(repo, tool, stamps, warnings, matching)
+    real_warnings = [warning for warning in warnings if len(warning.trace) < len(paths)]
+    return len(warnings), real_warnings
+
+""" Compare all tags of a repo for one tool and save its real warnings """
+def compare_repo(repo, tool, cwes, progress=True, incremental=False, columnar=False, compact=False, matching='window', memory_mb=None):
+    metrics = JobMetrics(repo, tool)
+    if memory_mb:
+        metrics.warnings, real_warnings = get_real_warnings_partitioned(repo, tool, memory_mb, progress, metrics, matching)
+    elif incremental:
+        metrics.warnings, real_warnings = get_real_warnings_incremental(repo, tool, progress, metrics, matching)
+    else:
+        with metrics.stage('load'):
             sarifs = load_sarifs(repo, tool)
+            metrics.sarif_bytes += sum(sarif.size for sarif in sarifs)
+        with metrics.stage('match'):
+            real_warnings = get_real_warnings(sarifs, progress, metrics, matching)
+        metrics.warnings = len(sarifs[0].results)
+    metrics.real_warnings = len(real_warnings)
+
+    # save real warnings
+    warning_dir_path = f'reports/{tool}/{repo}/'
+    os.makedirs(warning_dir_path, exist_ok=True)
+    uni_warnings = []
+    uniform_time = 0.0
+    with metrics.stage('write'):
+        with open(f'{warning_dir_path}warnings.json', 'w') as f, \
+                JsonArrayWriter(f, indent=None if compact else 2) as writer:
+            for warning in real_warnings:
+                start = time.perf_counter()
+                uni_warning = uniform_warning(warning, tool, cwes)
+                uniform_time += time.perf_counter() - start
+                if uni_warning is None:
+                    metrics.dropped += 1
+                    continue
+                writer.write(uni_warning)
+                if columnar:
+                    uni_warnings.append(uni_warning)
+        if columnar:
+            write_columnar(f'{warning_dir_path}warnings.npz', uni_warnings)
+    # uniform runs interleaved with writing, report it on its own
+    metrics.add_time('write', -uniform_time)
+    metrics.add_time('uniform', uniform_time)
+    return metrics
+
+def summary(metrics):
+    text = f'{metrics.repo} {metrics.tool}: {metrics.warnings} warnings, {metrics.real_warnings} real warnings, {metrics.dropped} dropped for unknown rules'
+    if metrics.matching:
+        text += ', matching ' + ' '.join(f'{outcome}={n}' for outcome, n in metrics.matching.items())
+    return text
+
+""" Run a single job under cProfile and tracemalloc """
+def profile_job(repo, tool, cwes, output, **kwargs):
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    metrics = profiler.runcall(compare_repo, repo, tool, cwes, **kwargs)
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    profiler.dump_stats(output)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+    print(f'Peak traced memory: {peak / 2 ** 20:.1f} MiB, top allocations:')
+    for stat in snapshot.statistics('lineno')[:10]:
+        print(stat)
+    print(f'Profile saved to {output}')
+    return metrics
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of (repo, tool) pairs to compare in parallel')
+    parser.add_argument('--incremental', action='store_true', help='reuse saved traces and only match newly added tags')
+    parser.add_argument('--columnar', action='store_true', help='also write warnings.npz next to warnings.json')
+    parser.add_argument('--compact', action='store_true', help='write warnings.json one warning per line without indentation')
+    parser.add_argument('--matching', choices=['window', 'fingerprint'], default='window',
+                        help='follow traces by line window, or by fingerprint with the window as fallback')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='match out of core: spill results to disk by file and match a partition of about MB at a time')
+    parser.add_argument('--metrics', help='write per job timings and counters to this JSON file')
+    parser.add_argument('--profile', metavar='REPO/TOOL', help='only run this job, under cProfile and tracemalloc')
+    parser.add_argument('--profile-output', default='compare.prof', help='where to save the cProfile stats')
+    args = parser.parse_args()
+
+    cwes = load_cwes('rules.csv')
+    options = dict(incremental=args.incremental, columnar=args.columnar, compact=args.compact, matching=args.matching, memory_mb=args.memory_limit)
+    jobs = [(repo, tool) for repo in repos for tool in tools]
+    all_metrics = []
+    if args.profile:
+        repo, tool = args.profile.split('/')
+        metrics = profile_job(repo, tool, cwes, args.profile_output, **options)
+        print(summary(metrics))
+        all_metrics.append(metrics)
+    elif args.jobs <= 1:
+        for repo, tool in jobs:
             print("Processing ", repo, " ", tool)
-            # compare warnings
             try:
-                real_warnings = get_real_warnings(sarifs)
+                metrics = compare_repo(repo, tool, cwes, **options)
             except Exception as e:
-                print(f'Error in {repo} {tool}: {e}')
+                print(f'Error in {repo} {tool}: {e!r}')
                 continue
-            print(f'{repo} {tool}: {len(sarifs[0].results)} warnings, {len(real_warnings)} real warnings')
-
-            # save real warnings
-            warning_dir_path = f'reports/{tool}/{repo}/'
-            os.makedirs(warning_dir_path, exist_ok=True)
-            with open(f'{warning_dir_path}warnings.json', 'w') as f:
-                uni_warnings = uniform(real_warnings, tool, rules)
-                json.dump(uni_warnings, f, cls=Encoder, indent=2)
+            print(summary(metrics))
+            all_metrics.append(metrics)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {
+                executor.submit(compare_repo, repo, tool, cwes, False, **options): (repo, tool)
+                for repo, tool in jobs
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc='Processing jobs'):
+                repo, tool = futures[future]
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    tqdm.write(f'Error in {repo} {tool}: {e!r}')
+                    continue
+                tqdm.write(summary(metrics))
+                all_metrics.append(metrics)
+        all_metrics.sort(key=lambda m: jobs.index((m.repo, m.tool)))
+
+    if args.metrics:
+        write_metrics(args.metrics, all_metrics)
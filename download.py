@@ -1,8 +1,19 @@
 from math import fabs
 import os
+import json
+import hashlib
+import argparse
+import shutil
+import threading
 import requests
 import tarfile
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from atomic import atomic_write
 
 proxies = {
     "http": "http://localhost:7890",
@@ -13,67 +24,236 @@ proxies = {
 
 # }
 
-def get_tags(repo_url: str):
-    user, repo = repo_url.rstrip('/').split('/')[-2:]
-    api_url = f"https://api.github.com/repos/{user}/{repo}/tags"
-    tags = []
+# point these at a local server to test without GitHub
+API_URL = "https://api.github.com"
+ARCHIVE_URL = "https://github.com"
+
+# GitHub API responses, revalidated with ETag / Last-Modified
+HTTP_CACHE_DIR = '.cache/http'
+
+# files shared by the tags of a repo with --dedup, kept out of the tag directories
+OBJECTS_DIR = '.cache/objects'
+
+MAX_WORKERS = 8
+MAX_TAGS = 10
+CHUNK_SIZE = 1 << 20
+
+# reject unsafe members where tarfile supports extraction filters
+EXTRACT_ARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
 
+def make_session(workers: int = MAX_WORKERS, retries: int = 3, backoff: float = 0.5):
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def api_headers():
     github_token = os.getenv("GITHUB_TOKEN")
-    headers = {'Authorization': f'token {github_token}'} if github_token else {}
+    return {'Authorization': f'token {github_token}'} if github_token else {}
+
+def _cache_path(url: str):
+    return os.path.join(HTTP_CACHE_DIR, hashlib.sha1(url.encode('UTF-8')).hexdigest() + '.json')
+
+def _read_cache(url: str):
+    try:
+        with open(_cache_path(url), 'r', encoding='UTF-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    response = requests.get(f"{api_url}", headers=headers, proxies=proxies)
+def _write_cache(url: str, entry: dict):
+    with atomic_write(_cache_path(url), encoding='UTF-8') as f:
+        json.dump(entry, f)
+
+""" GET a GitHub API url through the response cache, returns the json body and the next page url """
+def get_json(session, url: str, offline: bool = False, immutable: bool = False):
+    entry = _read_cache(url)
+    # commits are addressed by sha and never change, everything else is revalidated
+    if entry is not None and (offline or immutable):
+        return entry['body'], entry['next']
+    if offline:
+        raise LookupError(f"{url} is not cached, cannot fetch it offline")
+
+    headers = api_headers()
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    response = session.get(url, headers=headers, proxies=proxies)
+    if response.status_code == 304 and entry is not None:
+        return entry['body'], entry['next']
     response.raise_for_status()
-    data = response.json()
-
-    for tag in data:
-        if len(tags) >= 10:
-            break
-        tag_name = tag['name']
-        commit_url = tag['commit']['url']
-        commit_response = requests.get(commit_url, headers=headers, proxies=proxies)
-        try:
-            commit_response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"Error: {e}")
-            continue
-
-        commit_data = commit_response.json()
-        tag_date = commit_data['commit']['committer']['date']
-        if datetime.strptime(tag_date, "%Y-%m-%dT%H:%M:%SZ") > datetime.strptime("2023-01-01", "%Y-%m-%d"):
-            print(f"Tag {tag_name} created at {tag_date}")
-            tags.append((tag_name, tag_date))
+
+    entry = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'next': response.links.get('next', {}).get('url'),
+        'body': response.json(),
+    }
+    _write_cache(url, entry)
+    return entry['body'], entry['next']
+
+""" All tags of a repo, following the pages of the tags endpoint lazily """
+def iter_tags(session, api_url: str, offline: bool = False):
+    url = f"{api_url}?per_page=100"
+    while url:
+        data, url = get_json(session, url, offline)
+        yield from data
+
+""" Commit date of a tag, None if the commit could not be fetched """
+def get_tag_date(session, tag, offline: bool = False):
+    try:
+        commit_data, _ = get_json(session, tag['commit']['url'], offline, immutable=True)
+    except (requests.exceptions.RequestException, LookupError) as e:
+        print(f"Error: {e}")
+        return None
+    return commit_data['commit']['committer']['date']
+
+def get_tags(repo_url: str, session=None, workers: int = MAX_WORKERS, offline: bool = False, max_tags: int = MAX_TAGS):
+    user, repo = repo_url.rstrip('/').split('/')[-2:]
+    api_url = f"{API_URL}/repos/{user}/{repo}/tags"
+    tags = []
+    session = session or make_session(workers)
+
+    all_tags = iter_tags(session, api_url, offline)
+
+    # fetch commit dates a batch at a time, keeping the order of the tag list
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not max_tags or len(tags) < max_tags:
+            batch = list(islice(all_tags, workers))
+            if not batch:
+                break
+            dates = executor.map(lambda tag: get_tag_date(session, tag, offline), batch)
+            for tag, tag_date in zip(batch, dates):
+                if max_tags and len(tags) >= max_tags:
+                    break
+                if tag_date is None:
+                    continue
+                tag_name = tag['name']
+                if datetime.strptime(tag_date, "%Y-%m-%dT%H:%M:%SZ") > datetime.strptime("2023-01-01", "%Y-%m-%d"):
+                    print(f"Tag {tag_name} created at {tag_date}")
+                    tags.append((tag_name, tag_date))
 
     tags = sorted(tags, key=lambda x: datetime.strptime(x[1], "%Y-%m-%dT%H:%M:%SZ"))
     print(tags)
     return tags
 
-def download_and_extract_tag(repo_url: str, tag_name: str, tag_num: int):
+def _included(name: str, include):
+    if not include:
+        return True
+    # patterns are matched below the top level directory of the tarball
+    inner = name.split('/', 1)[1] if '/' in name else ''
+    return any(fnmatch(inner, pattern) for pattern in include)
+
+""" Copy a file into the content-addressed store, returns the path of its object """
+def _store_object(fileobj, objects_dir: str, mode: int = 0o644):
+    os.makedirs(objects_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(objects_dir, f'.tmp-{os.getpid()}-{threading.get_ident()}')
+    with open(tmp_path, 'wb') as out:
+        for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    # hardlinks share their mode, so files only differing in it are different objects
+    mode &= 0o777
+    os.chmod(tmp_path, mode)
+    name = f'{digest.hexdigest()}-{mode:o}'
+    object_path = os.path.join(objects_dir, name[:2], name[2:])
+    if os.path.exists(object_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(tmp_path, object_path)
+    return object_path
+
+""" Extract a .tar.gz stream member by member, optionally only matching files and deduplicated """
+def extract_stream(fileobj, extract_dir: str, include=None, objects_dir=None):
+    root = os.path.realpath(extract_dir)
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            if member.isdir():
+                # with a filter directories are created for the files that are kept
+                if not include:
+                    tar.extract(member, path=extract_dir, **EXTRACT_ARGS)
+                continue
+            if not _included(member.name, include):
+                continue
+            target = os.path.realpath(os.path.join(extract_dir, member.name))
+            if not target.startswith(root + os.sep):
+                print(f"Skipping {member.name}: outside of {extract_dir}")
+                continue
+            if member.isfile() and objects_dir:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                object_path = _store_object(tar.extractfile(member), objects_dir, member.mode)
+                try:
+                    os.link(object_path, target)
+                except OSError:
+                    shutil.copyfile(object_path, target)
+            else:
+                tar.extract(member, path=extract_dir, **EXTRACT_ARGS)
+
+def download_and_extract_tag(repo_url: str, tag_name: str, tag_num: int, session=None, include=None, dedup: bool = False):
     user, repo = repo_url.rstrip('/').split('/')[-2:]
     extract_dir = os.path.join(repo, f"tag_{tag_num}")
     # if dir exist, pass
     if os.path.exists(extract_dir):
         print(f"pass tag_{tag_num}")
         return
-    tarball_url = f"https://github.com/{user}/{repo}/archive/refs/tags/{tag_name}.tar.gz"
+    tarball_url = f"{ARCHIVE_URL}/{user}/{repo}/archive/refs/tags/{tag_name}.tar.gz"
     print(f"Downloading {tag_name} from {tarball_url}...")
 
-    response = requests.get(tarball_url)
-    response.raise_for_status()
-    
-    compressed_file = os.path.join(repo, ".tar.gz")
-    with open(compressed_file, 'wb') as f:
-        f.write(response.content)
-    print(f"Extracting {compressed_file}...")
-    with tarfile.open(compressed_file, "r:gz") as tar:
-        tar.extractall(path=extract_dir)
-    os.remove(compressed_file)
-
-def main(repo_url: str):
+    session = session or make_session()
+    # extract next to the final dir so a failed download is never taken for a finished tag
+    partial_dir = f"{extract_dir}.partial"
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    objects_dir = os.path.join(OBJECTS_DIR, repo) if dedup else None
+    try:
+        with session.get(tarball_url, stream=True) as response:
+            response.raise_for_status()
+            # only undo HTTP content encoding, the gzip of the tarball is left to tarfile
+            response.raw.decode_content = True
+            print(f"Extracting {tag_name}...")
+            extract_stream(response.raw, partial_dir, include, objects_dir)
+        os.replace(partial_dir, extract_dir)
+    finally:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+
+def main(repo_url: str, workers: int = MAX_WORKERS, offline: bool = False, max_tags: int = MAX_TAGS, include=None, dedup: bool = False):
     print(f"Processing repository: {repo_url}")
-    tags = get_tags(repo_url)
-    for i in range(len(tags)):
-        download_and_extract_tag(repo_url, tags[i][0], i + 1)
+    session = make_session(workers)
+    tags = get_tags(repo_url, session, workers, offline, max_tags)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_and_extract_tag, repo_url, tags[i][0], i + 1, session, include, dedup): tags[i][0]
+            for i in range(len(tags))
+        }
+        errors = []
+        for future, tag_name in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error downloading {tag_name}: {e}")
+                errors.append(tag_name)
+    if errors:
+        print(f"Failed tags: {errors}")
 
 if __name__ == "__main__":
-    repo_url = input("Enter GitHub repository URL (e.g., https://github.com/owner/repo): ")
-    main(repo_url)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("repo_url", nargs="?")
+    parser.add_argument("--jobs", "-j", type=int, default=MAX_WORKERS, help="parallel requests")
+    parser.add_argument("--offline", action="store_true", help="only use cached GitHub API responses")
+    parser.add_argument("--max-tags", type=int, default=MAX_TAGS, help="number of tags to download, 0 for all")
+    parser.add_argument("--include", nargs="+", help="only extract files matching these patterns, e.g. 'src/main/*' 'pom.xml'")
+    parser.add_argument("--dedup", action="store_true", help="store identical files of all tags once and hardlink them")
+    args = parser.parse_args()
+    repo_url = args.repo_url or input("Enter GitHub repository URL (e.g., https://github.com/owner/repo): ")
+    main(repo_url, args.jobs, args.offline, args.max_tags, args.include, args.dedup)
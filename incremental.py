@@ -0,0 +1,145 @@
+""" State kept between consecutive tags of a repo so PMD and SpotBugs only analyse what changed """
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+INCREMENTAL_DIR = '.cache/incremental'
+
+def state_dir(tool: str, repo: str):
+    return os.path.join(INCREMENTAL_DIR, tool, repo)
+
+def file_hash(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+""" Hardlink every file of a checkout into a fixed per-repo directory, so paths are the same for every tag """
+def mirror_tree(source: str, mirror: str, ignored_dirs=(), ignored_suffixes=()):
+    shutil.rmtree(mirror, ignore_errors=True)
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [d for d in dirs if d not in ignored_dirs]
+        target_root = os.path.join(mirror, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            if name.endswith(ignored_suffixes):
+                continue
+            try:
+                os.link(os.path.join(root, name), os.path.join(target_root, name))
+            except OSError:
+                shutil.copyfile(os.path.join(root, name), os.path.join(target_root, name))
+
+""" Point file URIs of a report made in the mirror back at the checkout """
+def rewrite_uris(path: str, mirror: str, checkout: str):
+    with open(path, 'r', encoding='UTF-8') as f:
+        text = f.read()
+    text = text.replace(Path(mirror).resolve().as_uri() + '/', Path(checkout).resolve().as_uri() + '/')
+    with open(path, 'w', encoding='UTF-8') as f:
+        f.write(text)
+
+""" Directory the package hierarchy of a class file starts in, e.g. module/target/classes """
+def class_root(path: str):
+    parts = Path(path).parts
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] in ('classes', 'test-classes'):
+            return str(Path(*parts[:i + 1]))
+    return None
+
+""" Source file SpotBugs reports a class under, e.g. org/apache/Foo$Bar.class -> org/apache/Foo.java """
+def class_source(path: str):
+    root = class_root(path)
+    relative = os.path.relpath(path, root) if root else path
+    directory, name = os.path.split(relative)
+    name = name[:-len('.class')].split('$')[0] + '.java'
+    return Path(directory, name).as_posix()
+
+def class_hashes(checkout: str, excluded: str = '/opennlp-distr/'):
+    """ relative class file path -> content hash, the same classes spotbugs_run finds """
+    hashes = {}
+    for root, _, files in os.walk(checkout):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith('class') and excluded not in path:
+                hashes[os.path.relpath(path, checkout)] = file_hash(path)
+    return hashes
+
+""" Sources whose classes were added, removed or changed since the last analysed tag """
+def changed_sources(previous: dict, current: dict):
+    changed = set()
+    for path in previous.keys() | current.keys():
+        if previous.get(path) != current.get(path):
+            changed.add(class_source(path))
+    return changed
+
+def load_state(tool: str, repo: str):
+    """ Class hashes and SARIF of the last analysed tag, None if there is none """
+    directory = state_dir(tool, repo)
+    try:
+        with open(os.path.join(directory, 'classes.json'), 'r', encoding='UTF-8') as f:
+            classes = json.load(f)
+        with open(os.path.join(directory, 'last.sarif'), 'r', encoding='UTF-8') as f:
+            sarif = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return classes, sarif
+
+def save_state(tool: str, repo: str, classes: dict, sarif_path: str):
+    directory = state_dir(tool, repo)
+    os.makedirs(directory, exist_ok=True)
+    shutil.copyfile(sarif_path, os.path.join(directory, 'last.sarif'))
+    with open(os.path.join(directory, 'classes.json'), 'w', encoding='UTF-8') as f:
+        json.dump(classes, f)
+
+def _result_source(result: dict):
+    try:
+        return result['locations'][0]['physicalLocation']['artifactLocation']['uri']
+    except (KeyError, IndexError):
+        return None
+
+""" Previous results of unchanged sources plus the new results of changed ones in SpotBugs' order, with a merged rule table """
+def merge_spotbugs(previous: dict, partial, changed: set):
+    merged = json.loads(json.dumps(previous))
+    run = merged['runs'][0]
+    old_rules = run['tool']['driver'].get('rules', [])
+    results = [
+        (result, old_rules[result['ruleIndex']] if 'ruleIndex' in result else None)
+        for result in run.get('results', [])
+        if _result_source(result) not in changed
+    ]
+    if partial is not None:
+        new_run = partial['runs'][0]
+        new_rules = new_run['tool']['driver'].get('rules', [])
+        results += [
+            (result, new_rules[result['ruleIndex']] if 'ruleIndex' in result else None)
+            for result in new_run.get('results', [])
+        ]
+
+    # SpotBugs lists results by source file, results of one source all come from the same run
+    results.sort(key=lambda item: _result_source(item[0]) or '')
+
+    # only rules that still have results are listed, as in a full run
+    rules, index = [], {}
+    for result, rule in results:
+        if rule is None:
+            continue
+        if rule['id'] not in index:
+            index[rule['id']] = len(rules)
+            rules.append(rule)
+        result['ruleIndex'] = index[rule['id']]
+    run['tool']['driver']['rules'] = rules
+    run['results'] = [result for result, _ in results]
+
+    # CWE taxa referenced by the new rules
+    if partial is not None:
+        taxonomies = {taxonomy['name']: taxonomy for taxonomy in run.setdefault('taxonomies', [])}
+        for taxonomy in partial['runs'][0].get('taxonomies', []):
+            if taxonomy['name'] not in taxonomies:
+                run['taxonomies'].append(taxonomy)
+                continue
+            taxa = taxonomies[taxonomy['name']].setdefault('taxa', [])
+            known = {taxon['id'] for taxon in taxa}
+            taxa.extend(taxon for taxon in taxonomy.get('taxa', []) if taxon['id'] not in known)
+    return merged
@@ -0,0 +1,135 @@
+import re
+import csv
+import argparse
+import numpy as np
+from rule import RULE_CWE, tools
+from sarif import load_rules
+from catalog import list_sarif_files
+
+# words that say nothing about the weakness
+STOP_WORDS = {
+    'the', 'and', 'for', 'this', 'that', 'with', 'are', 'not', 'should', 'can', 'may', 'use',
+    'used', 'from', 'when', 'which', 'will', 'its', 'into', 'has', 'have', 'been', 'than',
+    'such', 'java', 'code', 'class', 'method', 'methods', 'rule', 'avoid', 'https', 'http',
+}
+
+def tokens(text: str):
+    # split camelCase and snake/kebab ids into words
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text).lower()
+    return [word for word in re.findall(r'[a-z][a-z0-9]+', text) if len(word) > 2 and word not in STOP_WORDS]
+
+""" All descriptive text of a SARIF rule, whatever the tool puts it in """
+def rule_text(rule: dict):
+    parts = [rule['id']]
+    for key in ('shortDescription', 'fullDescription', 'help'):
+        if rule.get(key):
+            parts.append(rule[key].get('text', ''))
+    for message in rule.get('messageStrings', {}).values():
+        parts.append(message.get('text', ''))
+    properties = rule.get('properties', {})
+    for key in ('name', 'description'):
+        if properties.get(key):
+            parts.append(properties[key])
+    return ' '.join(parts)
+
+class TfidfIndex:
+    """ L2 normalised TF-IDF vectors of a set of documents """
+    def __init__(self, documents: list, min_df: int = 1):
+        counts = [self._count(doc) for doc in documents]
+        df = {}
+        for count in counts:
+            for word in count:
+                df[word] = df.get(word, 0) + 1
+        self.vocabulary = {word: i for i, word in enumerate(sorted(w for w, n in df.items() if n >= min_df))}
+        n = len(documents)
+        self.idf = np.ones(len(self.vocabulary), dtype=np.float32)
+        for word, i in self.vocabulary.items():
+            self.idf[i] = np.log((1 + n) / (1 + df[word])) + 1
+
+    def _count(self, doc: str):
+        count = {}
+        for word in tokens(doc):
+            count[word] = count.get(word, 0) + 1
+        return count
+
+    def transform(self, documents: list):
+        matrix = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(documents):
+            for word, n in self._count(doc).items():
+                i = self.vocabulary.get(word)
+                if i is not None:
+                    matrix[row, i] = 1 + np.log(n)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+""" Rules of every SARIF under repos/, split into those with a known CWE and those without """
+def collect_rules(tools=tools):
+    rules = {}
+    for tool, path in list_sarif_files(tools):
+        for rule in load_rules(path):
+            cwe = RULE_CWE[tool](rule)
+            # the first of duplicated ids wins unless a later one knows its CWE, as in catalog.py
+            if rule['id'] not in rules or (rules[rule['id']][2] == 'CWE-unknown' and cwe != 'CWE-unknown'):
+                rules[rule['id']] = (tool, rule['id'], cwe, rule_text(rule))
+    known = [entry for entry in rules.values() if entry[2] != 'CWE-unknown']
+    unknown = [entry for entry in rules.values() if entry[2] == 'CWE-unknown']
+    return known, unknown
+
+""" Give each unknown rule the CWE of its most similar known rule, with the cosine similarity as confidence """
+def infer_cwes(known: list, unknown: list):
+    if not known or not unknown:
+        return []
+    index = TfidfIndex([text for *_, text in known] + [text for *_, text in unknown])
+    known_vectors = index.transform([text for *_, text in known])
+    unknown_vectors = index.transform([text for *_, text in unknown])
+    similarity = unknown_vectors @ known_vectors.T
+    nearest = similarity.argmax(axis=1)
+    scores = similarity[np.arange(len(unknown)), nearest]
+    return [
+        {
+            'tool': tool,
+            'id': rule_id,
+            'cwe': known[j][2],
+            'score': float(score),
+            'neighbour': known[j][1],
+        } for (tool, rule_id, _, _), j, score in zip(unknown, nearest.tolist(), scores.tolist())
+    ]
+
+""" Fill CWE-unknown rows of rules.csv whose inferred CWE is confident enough, returns how many """
+def apply_to_csv(csv_filepath, inferred: list, threshold: float):
+    with open(csv_filepath, mode='r') as file:
+        reader = csv.DictReader(file)
+        rows = list(reader)
+    confident = {entry['id']: entry['cwe'] for entry in inferred if entry['score'] >= threshold}
+    filled = 0
+    for row in rows:
+        if row['cwe'] == 'CWE-unknown' and row['id'] in confident:
+            row['cwe'] = confident[row['id']]
+            filled += 1
+    with open(csv_filepath, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return filled
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=float, default=0.25, help='minimum similarity to trust an inferred CWE')
+    parser.add_argument('--output', default='rules_inferred.csv', help='where to write every inferred CWE and its score')
+    parser.add_argument('--apply', action='store_true', help='fill CWE-unknown rows of rules.csv above the threshold')
+    args = parser.parse_args()
+
+    known, unknown = collect_rules()
+    inferred = infer_cwes(known, unknown)
+    with open(args.output, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['tool', 'id', 'cwe', 'score', 'neighbour'])
+        writer.writeheader()
+        writer.writerows(sorted(inferred, key=lambda entry: -entry['score']))
+
+    confident = sum(entry['score'] >= args.threshold for entry in inferred)
+    print(f'{len(known)} known rules, {len(unknown)} unknown, {confident} inferred with score >= {args.threshold}')
+    if args.apply:
+        filled = apply_to_csv('rules.csv', inferred, args.threshold)
+        print(f'Filled {filled} rows of rules.csv, the rest is left for askCWE.py')
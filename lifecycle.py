@@ -0,0 +1,118 @@
+""" When each warning of a repo was introduced, fixed and reintroduced, in one pass over its tags """
+import argparse
+import os
+from tqdm import tqdm
+from warning import TraceEntry, LINE_WINDOW
+from compare import SarifData, list_sarifs, repos, tools
+from uniform import JsonArrayWriter
+
+""" Pair results of two consecutive tags one to one, each previous trace takes its first free match in file order """
+def match_tags(previous: list, current: SarifData):
+    pairs = {}
+    used = set()
+    for p, trace in enumerate(previous):
+        for i in current.candidate_positions(trace):
+            if i not in used:
+                used.add(i)
+                pairs[p] = i
+                break
+    return pairs
+
+class LifecycleTracker:
+    """ Lifecycle of every warning seen so far, fed one tag at a time """
+    def __init__(self):
+        self.warnings = []
+        # warning id of each result of the last tag, and their traces
+        self.alive = []
+        self.traces = []
+        # fixed warnings by match key, so a warning coming back is recognised
+        self.fixed = {}
+        self.tags = []
+
+    def _new_warning(self, trace: TraceEntry, tag: int):
+        self.warnings.append({
+            'id': len(self.warnings),
+            'rule': trace.rule_id(),
+            'uri': trace.uri(),
+            'start_line': trace.start_line(),
+            'message': trace.message(),
+            'introduced': tag,
+            'fixed': None,
+            'reintroduced': 0,
+            'episodes': [[tag, None]],
+        })
+        return len(self.warnings) - 1
+
+    def _reopen(self, trace: TraceEntry, tag: int):
+        entries = self.fixed.get(trace.match_key())
+        if not entries:
+            return None
+        for n, (line, warning_id) in enumerate(entries):
+            if abs(line - trace.start_line()) < LINE_WINDOW:
+                del entries[n]
+                warning = self.warnings[warning_id]
+                warning['fixed'] = None
+                warning['reintroduced'] += 1
+                warning['episodes'].append([tag, None])
+                return warning_id
+        return None
+
+    def add_tag(self, sarif: SarifData):
+        traces = [TraceEntry(result) for result in sarif.results]
+        pairs = match_tags(self.traces, sarif) if self.tags else {}
+        alive = [None] * len(traces)
+        for p, i in pairs.items():
+            alive[i] = self.alive[p]
+
+        for p, warning_id in enumerate(self.alive):
+            if p in pairs:
+                continue
+            warning = self.warnings[warning_id]
+            warning['fixed'] = sarif.tag
+            warning['episodes'][-1][1] = sarif.tag
+            trace = self.traces[p]
+            self.fixed.setdefault(trace.match_key(), []).append((trace.start_line(), warning_id))
+
+        for i, trace in enumerate(traces):
+            if alive[i] is None:
+                warning_id = self._reopen(trace, sarif.tag) if self.tags else None
+                alive[i] = warning_id if warning_id is not None else self._new_warning(trace, sarif.tag)
+
+        self.alive = alive
+        self.traces = traces
+        self.tags.append(sarif.tag)
+
+""" Track the warnings of a repo and tool through all its tags, loading one SARIF at a time """
+def track(repo: str, tool: str, progress: bool = True):
+    tracker = LifecycleTracker()
+    for tag, path in tqdm(list_sarifs(repo, tool), desc=f'{repo} {tool}', disable=not progress):
+        tracker.add_tag(SarifData(path, tag, tool))
+    return tracker
+
+def write_lifecycle(path: str, tracker: LifecycleTracker, compact: bool = False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f, JsonArrayWriter(f, indent=None if compact else 2) as writer:
+        for warning in tracker.warnings:
+            writer.write(warning)
+
+def summary(repo: str, tool: str, tracker: LifecycleTracker):
+    fixed = sum(warning['fixed'] is not None for warning in tracker.warnings)
+    reintroduced = sum(warning['reintroduced'] > 0 for warning in tracker.warnings)
+    return f'{repo} {tool}: {len(tracker.warnings)} warnings over {len(tracker.tags)} tags, {fixed} fixed, {reintroduced} reintroduced'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', nargs='+', default=repos)
+    parser.add_argument('--tools', nargs='+', default=tools)
+    parser.add_argument('--compact', action='store_true', help='write one warning per line without indentation')
+    args = parser.parse_args()
+
+    for repo in args.repos:
+        for tool in args.tools:
+            try:
+                tracker = track(repo, tool)
+            except AssertionError:
+                print(f'Skipping {repo} {tool}: not every tag has a {tool}.sarif')
+                continue
+            write_lifecycle(f'reports/{tool}/{repo}/lifecycle.json', tracker, args.compact)
+            print(summary(repo, tool, tracker))
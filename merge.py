@@ -1,45 +1,121 @@
 import json
-from uniform import Encoder
+import argparse
+from bisect import bisect_left, bisect_right, insort
+from uniform import JsonArrayWriter
+from columnar import ColumnarReport
+import store
 import os
 from tqdm import tqdm
 
 repos = ['commons-io', 'commons-lang', 'opennlp', 'pdfbox', 'ratis']
 tools = ['codeql', 'pmd', 'spotbugs', 'semgrep']
 
+LINE_WINDOW = 20
+
 def get_report(repo, tool):
     report_path = f'reports/{tool}/{repo}/warnings.json'
     with open(report_path, 'r') as f:
         return json.load(f)
 
+def get_store_report(conn, repo, tool):
+    return store.get_report(conn, repo, tool)
+
+def get_columnar_report(repo, tool):
+    return ColumnarReport(f'reports/{tool}/{repo}/warnings.npz')
+
+""" Merge one tool's json report, each warning is a full dict """
+def merge_report(merged, report, tool):
+    cur_warnings = []
+    for warning in report:
+        same = merged.find(warning)
+        if same is not None:
+            merged.agree_with(same, tool)
+        else:
+            cur_warnings.append(warning)
+    # warnings of one tool are only merged with those of earlier tools
+    for warning in cur_warnings:
+        merged.add(warning, tool)
+
+""" Merge one tool's columnar report, only rows that are kept get loaded in full """
+def merge_columnar_report(merged, report, tool):
+    files = report.column('file')
+    lines = report.column('start_line')
+    cur_rows = []
+    for i in range(len(report)):
+        same = merged.find({"file": files[i], "start_line": lines[i]})
+        if same is not None:
+            merged.agree_with(same, tool)
+        else:
+            cur_rows.append(i)
+    for i in cur_rows:
+        merged.add(report.row(i), tool)
+
+def file_name(war):
+    return war["file"].split("/")[-1]
+
 def same_warning(war1, war2):
     same = \
-        war1["file"].split("/")[-1] == war2["file"].split("/")[-1] and \
-        abs(war1["start_line"] - war2["start_line"]) < 20
+        file_name(war1) == file_name(war2) and \
+        abs(war1["start_line"] - war2["start_line"]) < LINE_WINDOW
     return same
 
+class MergedWarnings:
+    """ Merged warnings indexed by file name, each file sorted by start line """
+    def __init__(self):
+        self.warnings = []
+        self.agree = []
+        self.files = {}
+
+    """ Position of the earliest merged warning that is the same as war """
+    def find(self, war):
+        group = self.files.get(file_name(war))
+        if group is None:
+            return None
+        line = war["start_line"]
+        lo = bisect_left(group, (line - LINE_WINDOW + 1, -1))
+        hi = bisect_right(group, (line + LINE_WINDOW - 1, len(self.warnings)))
+        found = None
+        for _, i in group[lo:hi]:
+            if (found is None or i < found) and same_warning(war, self.warnings[i]):
+                found = i
+        return found
+
+    def add(self, war, tool):
+        i = len(self.warnings)
+        self.warnings.append(war)
+        self.agree.append({tool})
+        insort(self.files.setdefault(file_name(war), []), (war["start_line"], i))
+
+    """ Count tool as agreeing with merged warning i """
+    def agree_with(self, i, tool):
+        self.agree[i].add(tool)
+        # 3 tools have the same warning
+        if len(self.agree[i]) >= 3:
+            self.warnings[i]["flag"] = True
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--columnar', action='store_true', help='read warnings.npz instead of warnings.json')
+    parser.add_argument('--store', metavar='DB', help='read the reports from a database built by store.py')
+    parser.add_argument('--compact', action='store_true', help='write one merged warning per line without indentation')
+    args = parser.parse_args()
+
+    conn = store.connect(args.store) if args.store else None
     result_path = 'merged'
     if not os.path.exists(result_path):
         os.makedirs(result_path)
     for repo in tqdm(repos, position=0, desc='Processing repos'):
-        warnings = []
+        merged = MergedWarnings()
         for tool in tqdm(tools, position=1, desc='Processing tools', leave=False):
-            report = get_report(repo, tool)
-            cur_warnings = []
-            for warning in report:
-                hasSame = False
-                for war, dup in warnings:
-                    if same_warning(warning, war):
-                        dup += 1
-                        hasSame = True
-                        # 3 tools have the same warning
-                        if dup == 3:
-                            war["flag"] = True
-                        break
-                if not hasSame:
-                    cur_warnings.append((warning, 1))
-            warnings += cur_warnings
-        print(f"{repo}: {len(warnings)}")
-        result, _ = zip(*warnings)
-        with open(f"merged/{repo}.json", "w") as f:
-            json.dump(result, f, cls=Encoder, indent=2)
+            if args.store:
+                merge_report(merged, get_store_report(conn, repo, tool), tool)
+            elif args.columnar:
+                with get_columnar_report(repo, tool) as report:
+                    merge_columnar_report(merged, report, tool)
+            else:
+                merge_report(merged, get_report(repo, tool), tool)
+        print(f"{repo}: {len(merged.warnings)}")
+        with open(f"merged/{repo}.json", "w") as f, \
+                JsonArrayWriter(f, indent=None if args.compact else 2) as writer:
+            for warning in merged.warnings:
+                writer.write(warning)
@@ -0,0 +1,69 @@
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+# how a fingerprint lookup compared with the line window rule
+MATCHING_OUTCOMES = ('same', 'different', 'fingerprint_only', 'window_only', 'neither', 'fallback')
+
+class JobMetrics:
+    """ Timings and counters of one (repo, tool) compare job """
+    def __init__(self, repo: str, tool: str):
+        self.repo = repo
+        self.tool = tool
+        self.stages = {}
+        self.warnings = 0
+        self.real_warnings = 0
+        self.dropped = 0
+        self.comparisons = 0
+        self.sarif_bytes = 0
+        # tag -> [warnings looked up in that tag, warnings whose trace continued]
+        self.tags = {}
+        # outcome -> lookups, only filled when matching by fingerprint
+        self.matching = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_tag(self, tag: int, looked_up: int, matched: int):
+        counts = self.tags.setdefault(tag, [0, 0])
+        counts[0] += looked_up
+        counts[1] += matched
+
+    def add_matching(self, agreement: dict):
+        for outcome, n in agreement.items():
+            self.matching[outcome] = self.matching.get(outcome, 0) + n
+
+    def to_dict(self):
+        return {
+            'repo': self.repo,
+            'tool': self.tool,
+            'stages': self.stages,
+            'warnings': self.warnings,
+            'real_warnings': self.real_warnings,
+            'dropped': self.dropped,
+            'comparisons': self.comparisons,
+            'sarif_bytes': self.sarif_bytes,
+            'matching': self.matching,
+            'tags': {
+                str(tag): {
+                    'looked_up': looked_up,
+                    'matched': matched,
+                    'hit_rate': matched / looked_up if looked_up else None,
+                } for tag, (looked_up, matched) in sorted(self.tags.items())
+            },
+            # peak of the whole process, workers of a pool keep it across jobs
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+def write_metrics(path: str, metrics: list):
+    with open(path, 'w') as f:
+        json.dump([m.to_dict() for m in metrics], f, indent=2)
@@ -1,11 +1,20 @@
 from operator import truediv
 from optparse import check_choice
 import os
+import re
 import subprocess
 from typing import List, Dict, Any
 import typer
+import hashlib
+import shutil
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 from pathlib import Path
+import incremental
+import lifecycle
+from atomic import atomic_write
 
 app = typer.Typer()
 VERBOSE = False
@@ -27,8 +36,124 @@ JAVA_HOMES = {
     "ratis": "JAVA8_HOME"
 }
 
+# memory one run of each tool needs, in GB, used to limit how many run at once
+TOOL_MEMORY_GB = {
+    "infer": 6,
+    "spotbugs": 4,
+    "codeql": 8,
+    "pmd": 1,
+    "semgrep": 2,
+}
+
+# file each tool writes its results to, relative to the checkout
+TOOL_OUTPUTS = {
+    "infer": "infer-out/report.json",
+    "spotbugs": "spotbugs.sarif",
+    "codeql": "codeql.sarif",
+    "pmd": "pmd.sarif",
+    "semgrep": "semgrep.sarif",
+}
+
+TOOL_VERSION_COMMANDS = {
+    "infer": ["infer", "--version"],
+    "spotbugs": ["spotbugs", "-version"],
+    "codeql": ["codeql", "version", "--format=terse"],
+    "pmd": ["pmd", "--version"],
+    "semgrep": ["semgrep", "--version"],
+}
+
+PMD_RULESET = "rulesets/java/quickstart.xml"
+CODEQL_QUERIES = "java-security-and-quality.qls"
+CODEQL_DATABASE = "java-database"
+TOOL_RULESETS = {
+    "pmd": PMD_RULESET,
+    "codeql": CODEQL_QUERIES,
+}
+
+# results of every run, stored under a hash of the sources, tool version and ruleset
+RESULT_CACHE_DIR = ".cache/results"
+USE_CACHE = True
+# keep CodeQL databases so a new query pack only re-runs `database analyze`
+KEEP_DATABASE = False
+# reuse the analysis of the previous tag, tags of a repo then run one after another
+INCREMENTAL = False
+INCREMENTAL_TOOLS = {"pmd", "spotbugs"}
+
+# outputs of the tools, never part of the sources they analyse
+IGNORED_DIRS = {".git", "infer-out", CODEQL_DATABASE}
+IGNORED_SUFFIXES = (".sarif", ".log")
+# written by the builds of codeql and infer, only spotbugs analyses them
+BUILD_DIRS = {"target", "build"}
+
+@lru_cache(maxsize=None)
+def tool_version(tool: str):
+    """Version string of a tool, None if it cannot be run"""
+    try:
+        result = subprocess.run(TOOL_VERSION_COMMANDS[tool], check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+@lru_cache(maxsize=None)
+def tree_hash(path: str, builds: bool = False) -> str:
+    """Hash of the paths and contents of every source file in a checkout, build outputs only if asked for"""
+    ignored = IGNORED_DIRS if builds else IGNORED_DIRS | BUILD_DIRS
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in ignored)
+        for name in sorted(files):
+            if name.endswith(IGNORED_SUFFIXES):
+                continue
+            file_path = os.path.join(root, name)
+            file_digest = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_digest.update(chunk)
+            digest.update(os.path.relpath(file_path, path).encode("UTF-8") + b"\0")
+            digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+def result_key(tool: str, repo_path: str):
+    """Cache key of a run, None if the tool version is unknown"""
+    version = tool_version(tool)
+    if version is None:
+        return None
+    key = "\0".join([tool, version, TOOL_RULESETS.get(tool, ""), tree_hash(repo_path, tool == "spotbugs")])
+    return hashlib.sha256(key.encode("UTF-8")).hexdigest()
+
+def cached_result_path(tool: str, key: str) -> str:
+    return os.path.join(RESULT_CACHE_DIR, tool, key[:2], key[2:])
+
+def restore_result(tool: str, repo_path: str, key: str) -> bool:
+    """Copy a cached result into the checkout, returns whether there was one"""
+    cached = cached_result_path(tool, key)
+    if not os.path.exists(cached):
+        return False
+    try:
+        with open(f"{cached}.source") as f:
+            source = f.read()
+    except OSError:
+        return False
+    output = os.path.join(repo_path, TOOL_OUTPUTS[tool])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    shutil.copyfile(cached, output)
+    # absolute file URIs (pmd) still point at the checkout the result was made in
+    if source != str(Path(repo_path).resolve()):
+        incremental.rewrite_uris(output, source, repo_path)
+    return True
+
+def store_result(tool: str, repo_path: str, key: str):
+    output = os.path.join(repo_path, TOOL_OUTPUTS[tool])
+    if not os.path.exists(output):
+        return
+    cached = cached_result_path(tool, key)
+    with atomic_write(f"{cached}.source") as f:
+        f.write(str(Path(repo_path).resolve()))
+    with open(output, "rb") as src, atomic_write(cached, "wb") as f:
+        shutil.copyfileobj(src, f)
+
 # infer
-def infer_run():
+def infer_run(cwd: str, log):
     subprocess.run(
         [
             "infer", "run",
@@ -36,7 +161,9 @@ def infer_run():
             "-Drat.skip=true", "-Dmaven.test.skip=true", "-Dmdep.analyze.skip=true", "-Dskip=true", "-Danimal.sniffer.skip=true"
         ],
         check=True,
-        capture_output=not VERBOSE,
+        cwd=cwd,
+        stdout=log,
+        stderr=subprocess.STDOUT,
     )
 
 def compare_reports_infer(config, repo: str, base_report, compare_report, output_dir, cwd):
@@ -47,46 +174,113 @@ def compare_reports_infer(config, repo: str, base_report, compare_report, output
     ], check=True, capture_output=not VERBOSE)
 
 # spotbugs
-def spotbugs_run():
-    p1 = subprocess.Popen(["find", ".", "-name", "*class", "!", "-path", "*/opennlp-distr/*"], stdout=subprocess.PIPE)
-    p2 = subprocess.Popen(["spotbugs", "-textui", "-xargs", "-sarif=spotbugs.sarif"], stdin=p1.stdout, stdout=subprocess.PIPE)
+def repo_of(cwd: str) -> str:
+    # repos/{repo}/{tag}/{checkout}
+    return Path(cwd).parts[-3]
+
+def spotbugs_run(cwd: str, log):
+    if INCREMENTAL:
+        return spotbugs_run_incremental(cwd, log)
+    spotbugs_run_full(cwd, log)
+
+def spotbugs_run_full(cwd: str, log):
+    p1 = subprocess.Popen(["find", ".", "-name", "*class", "!", "-path", "*/opennlp-distr/*"], stdout=subprocess.PIPE, cwd=cwd)
+    p2 = subprocess.Popen(["spotbugs", "-textui", "-xargs", "-sarif=spotbugs.sarif"], stdin=p1.stdout, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
 
     p1.stdout.close()
     p2.communicate()
 
+def spotbugs_run_incremental(cwd: str, log):
+    """Analyse only the classes of sources changed since the last tag and merge them into its SARIF"""
+    repo = repo_of(cwd)
+    classes = incremental.class_hashes(cwd)
+    state = incremental.load_state("spotbugs", repo)
+    report = os.path.join(cwd, "spotbugs.sarif")
+    if state is None:
+        spotbugs_run_full(cwd, log)
+    else:
+        previous_classes, previous = state
+        changed = incremental.changed_sources(previous_classes, classes)
+        to_analyse = [path for path in classes if incremental.class_source(path) in changed]
+        partial = None
+        if to_analyse:
+            partial_path = os.path.abspath(os.path.join(incremental.state_dir("spotbugs", repo), "partial.sarif"))
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            # unchanged classes are still on the classpath for type information
+            roots = sorted({root for root in map(incremental.class_root, classes) if root})
+            args = ["spotbugs", "-textui"]
+            if roots:
+                args += ["-auxclasspath", os.pathsep.join(roots)]
+            args += ["-xargs", f"-sarif={partial_path}"]
+            process = subprocess.run(args, input="\n".join(to_analyse), text=True, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+            if not os.path.exists(partial_path):
+                raise subprocess.CalledProcessError(process.returncode, args)
+            with open(partial_path) as f:
+                partial = json.load(f)
+        print(f"spotbugs analysed {len(to_analyse)} of {len(classes)} classes of {cwd}")
+        with open(report, "w") as f:
+            json.dump(incremental.merge_spotbugs(previous, partial, changed), f)
+    if os.path.exists(report):
+        incremental.save_state("spotbugs", repo, classes, report)
+
 def compare_reports_spots_bugs():
     # TODO
     os.abort()
 
 # codeql
-def codeql_run():
+def codeql_run(cwd: str, log):
+    # a kept database is reused while the sources and CodeQL are unchanged
+    stamp_path = os.path.join(cwd, CODEQL_DATABASE, ".source-stamp")
+    stamp = f"{tool_version('codeql')}\n{tree_hash(cwd)}"
+    reuse = KEEP_DATABASE and os.path.isdir(os.path.join(cwd, CODEQL_DATABASE))
+    if reuse:
+        try:
+            with open(stamp_path) as f:
+                reuse = f.read() == stamp
+        except OSError:
+            reuse = False
+
     # Create the database
-    subprocess.run(
-        [
-            "codeql", "database", "create", "java-database", 
-            "--language=java", "--source-root=.", "--no-run-unnecessary-builds", "--overwrite"
-        ],
-        check=True,
-        capture_output=not VERBOSE,
-    )
+    if not reuse:
+        subprocess.run(
+            [
+                "codeql", "database", "create", CODEQL_DATABASE,
+                "--language=java", "--source-root=.", "--no-run-unnecessary-builds", "--overwrite"
+            ],
+            check=True,
+            cwd=cwd,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        if KEEP_DATABASE:
+            with open(stamp_path, "w") as f:
+                f.write(stamp)
 
     subprocess.run(
         [
-            "codeql", "database", "analyze", "java-database",
+            "codeql", "database", "analyze", CODEQL_DATABASE,
             "--format=sarif-latest", "--output=codeql.sarif",
-            "java-security-and-quality.qls"
+            CODEQL_QUERIES
         ],
         check=True,
-        capture_output=not VERBOSE,
+        cwd=cwd,
+        stdout=log,
+        stderr=subprocess.STDOUT,
     )
 
+    if KEEP_DATABASE:
+        return
+
     # Remove the database
     subprocess.run(
         [
-            "rm", "-rf", "java-database" 
+            "rm", "-rf", CODEQL_DATABASE
         ],
         check = True,
-        capture_output=not VERBOSE,
+        cwd=cwd,
+        stdout=log,
+        stderr=subprocess.STDOUT,
     )
 
 def compare_reports_codeql():
@@ -94,27 +288,53 @@ def compare_reports_codeql():
     os.abort()
 
 # pmd
-def pmd_run():
+def pmd_run(cwd: str, log):
+    if INCREMENTAL:
+        return pmd_run_incremental(cwd, log)
     subprocess.run(
         [
-            "pmd", "check", "-d", ".", "-f", "sarif", "-r", "pmd.sarif", "-R", "rulesets/java/quickstart.xml"
+            "pmd", "check", "-d", ".", "-f", "sarif", "-r", "pmd.sarif", "-R", PMD_RULESET
         ],
         check=True,
-        capture_output=not VERBOSE,
+        cwd=cwd,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+def pmd_run_incremental(cwd: str, log):
+    """Run PMD with an analysis cache shared by the tags of a repo"""
+    directory = incremental.state_dir("pmd", repo_of(cwd))
+    # PMD caches per absolute path, so every tag is analysed from the same mirror
+    mirror = os.path.abspath(os.path.join(directory, "tree"))
+    incremental.mirror_tree(cwd, mirror, IGNORED_DIRS, IGNORED_SUFFIXES)
+    report = os.path.abspath(os.path.join(cwd, "pmd.sarif"))
+    process = subprocess.run(
+        [
+            "pmd", "check", "-d", ".", "-f", "sarif", "-r", report, "-R", PMD_RULESET,
+            "--cache", os.path.abspath(os.path.join(directory, "analysis.cache"))
+        ],
+        cwd=mirror,
+        stdout=log,
+        stderr=subprocess.STDOUT,
     )
+    if os.path.exists(report):
+        incremental.rewrite_uris(report, mirror, cwd)
+    process.check_returncode()
 
 def compare_reports_pmd():
     # TODO
     os.abort()
 
 # semgrep
-def semgrep_run():
+def semgrep_run(cwd: str, log):
     subprocess.run(
         [
             "semgrep", "scan", ".", "--sarif-output=semgrep.sarif"
         ],
         check=True,
-        capture_output=not VERBOSE,
+        cwd=cwd,
+        stdout=log,
+        stderr=subprocess.STDOUT,
     )
 
 def compare_reports_semgrep():
@@ -171,6 +391,17 @@ def get_warning_key(warning):
     )
 
 def process_reports(tool: str, repo: str, tags: List[str]):
+    if tool != "infer":
+        # one pass over all tags instead of a diff against every base tag
+        try:
+            tracker = lifecycle.track(repo, tool, progress=VERBOSE)
+        except AssertionError:
+            print(f"Skipping {repo} {tool}: not every tag has a {tool}.sarif")
+            return
+        lifecycle.write_lifecycle(f"./reports/{tool}/{repo}/lifecycle.json", tracker)
+        print(lifecycle.summary(repo, tool, tracker))
+        return
+
     base_tag = tags[0]  # tag_1
     fixed_reports = []
     
@@ -211,8 +442,100 @@ def set_java_home(repo: str):
     os.environ["JAVA_HOME"] = os.getenv(java_home)
 
 def get_sorted_tags(tags: List[str]) -> List[str]:
+    tags = [tag for tag in tags if re.fullmatch(r"tag_\d+", tag)]
     return sorted(tags, key=lambda tag: int(tag.split("_")[-1]))
 
+class MemoryBudget:
+    """ Lets jobs run while the memory they reserve fits in the total """
+    def __init__(self, total_gb: float):
+        self.total = total_gb
+        self.available = total_gb
+        self.condition = threading.Condition()
+
+    def acquire(self, amount: float):
+        # a job bigger than the whole budget still runs, alone
+        amount = min(amount, self.total)
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+        return amount
+
+    def release(self, amount: float):
+        with self.condition:
+            self.available += amount
+            self.condition.notify_all()
+
+def total_memory_gb() -> float:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 30
+
+def source_size(path: str) -> int:
+    """Bytes of Java source in a checkout, used to start the longest jobs first"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.endswith(".java"):
+                size += os.path.getsize(os.path.join(root, name))
+    return size
+
+def log_path(tool: str, repo_path: str) -> str:
+    # repos/{repo}/{tag}/{checkout} -> logs/{tool}/{repo}_{tag}.log
+    return os.path.join("logs", tool, "_".join(Path(repo_path).parts[-3:-1]) + ".log")
+
+def run_tool(tool: str, repo_path: str, budget: MemoryBudget):
+    """Run one tool in a checkout with its output in a per-job log"""
+    if tool not in TOOL_RUNNERS:
+        raise ValueError(f"Unknown tool: {tool}")
+    key = result_key(tool, repo_path) if USE_CACHE else None
+    if key is not None and restore_result(tool, repo_path, key):
+        print(f"{tool} result of {repo_path} restored from cache")
+        return
+    path = log_path(tool, repo_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    reserved = budget.acquire(TOOL_MEMORY_GB.get(tool, 1))
+    try:
+        print(f"Processing {repo_path}")
+        with open(path, "w") as log:
+            TOOL_RUNNERS[tool](repo_path, log)
+        print(f"{tool} run successfully on {repo_path}")
+    finally:
+        budget.release(reserved)
+    if key is not None:
+        store_result(tool, repo_path, key)
+
+def run_chain(tool: str, repo_paths: List[str], budget: MemoryBudget) -> List[str]:
+    """Run a tool over checkouts one after another, returns the checkouts that failed"""
+    error_list = []
+    for repo_path in repo_paths:
+        try:
+            run_tool(tool, repo_path, budget)
+        except subprocess.CalledProcessError as e:
+            if VERBOSE:
+                print(f"Error: {e}, see {log_path(tool, repo_path)}")
+            error_list.append(repo_path)
+    return error_list
+
+def run_jobs(tool: str, repo_paths: List[str], workers: int, memory_gb: float) -> List[str]:
+    """Run a tool over many checkouts concurrently, returns the checkouts that failed"""
+    budget = MemoryBudget(memory_gb)
+    if INCREMENTAL and tool in INCREMENTAL_TOOLS:
+        # each tag builds on the previous one, so the tags of a repo run in order
+        chains = {}
+        for repo_path in repo_paths:
+            chains.setdefault(repo_of(repo_path), []).append(repo_path)
+        chains = [
+            sorted(chain, key=lambda repo_path: int(Path(repo_path).parts[-2].split("_")[-1]))
+            for chain in chains.values()
+        ]
+    else:
+        chains = [[repo_path] for repo_path in repo_paths]
+    chains = sorted(chains, key=lambda chain: sum(map(source_size, chain)), reverse=True)
+    error_list = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_chain, tool, chain, budget) for chain in chains]
+        for future in as_completed(futures):
+            error_list += future.result()
+    return error_list
+
 @app.command()
 def main(
     repos: List[str] = typer.Option([], "--repos", "-r", help="List of repos to process"),
@@ -222,9 +545,17 @@ def main(
     analyze: bool = typer.Option(False, "--analyze", "-a"),
     report: bool = typer.Option(False, "--report"),
     tool: str = typer.Option("infer", "--tool", help="Analysis tool to use"),
+    jobs: int = typer.Option(1, "--jobs", "-j", help="Number of tool runs at once"),
+    memory_gb: float = typer.Option(0, "--memory", help="GB of memory tool runs may use together, 0 for all of it"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Rerun tools even if a cached result matches the sources"),
+    keep_database: bool = typer.Option(False, "--keep-database", help="Keep CodeQL databases to reuse them on the next run"),
+    incremental_run: bool = typer.Option(False, "--incremental", help="Reuse the PMD/SpotBugs analysis of the previous tag of each repo"),
     ):
-    global VERBOSE
+    global VERBOSE, USE_CACHE, KEEP_DATABASE, INCREMENTAL
     VERBOSE = verbose
+    USE_CACHE = not no_cache
+    KEEP_DATABASE = keep_database
+    INCREMENTAL = incremental_run
     if len(repos) == 0:
         repos = DEFAULT_REPOS
     if len(ignore_repos) > 0:
@@ -232,6 +563,7 @@ def main(
     if len(included_tags) > 0:
         included_tags = [f"tag_{tag}" for tag in included_tags]
 
+    repo_paths = []
     # Choose a repo in repos
     for repo in repos:
         # set_java_home(repo)
@@ -246,7 +578,6 @@ def main(
 
         if VERBOSE:
             print(tags)
-        error_list = []
         for tag in tags:
             if len(included_tags) > 0 and tag not in included_tags:
                 continue
@@ -255,20 +586,10 @@ def main(
             root, dirname, _ = next(tag_walked)
             dirname = dirname[0]
             repo_path = os.path.join(root, dirname)
-            original_wd = os.getcwd()
-            os.chdir(repo_path)
-            try:
-                print(f"Processing {repo_path}")
-                if tool in TOOL_RUNNERS:
-                    TOOL_RUNNERS[tool]()
-                else:
-                    raise ValueError(f"Unknown tool: {tool}")
-                print(f"{tool} run successfully")
-            except subprocess.CalledProcessError as e:
-                if VERBOSE:
-                    print(f"Error: {e}")
-                error_list.append(repo_path)
-            os.chdir(original_wd)
+            repo_paths.append(repo_path)
+
+    if len(repo_paths) > 0:
+        error_list = run_jobs(tool, repo_paths, jobs, memory_gb or total_memory_gb())
         print(f"Error list: {error_list}")
 
 
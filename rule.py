@@ -1,9 +1,9 @@
 
 import os
 import glob
-import json
 import re
 import pandas as pd
+from sarif import load_rules
 
 class RuleEntry:
     def __init__(
@@ -25,53 +25,55 @@ def load_raw_rule(tool):
     sarif_file = glob.glob(path)
     assert len(sarif_file) == 1
     sarif_path = sarif_file[0]
-    with open(sarif_path, 'r', encoding='UTF-8') as f:
-        data = json.load(f)
-        rules = data['runs'][0]['tool']['driver']['rules']
-    return rules
+    return load_rules(sarif_path)
 
-def uni_codeql(all_rules):
-    rules = load_raw_rule('codeql')
+def codeql_cwe(rule):
+    for tag in rule['properties']['tags']:
+        matchObj = re.search(r'\d+', tag)
+        if matchObj:
+            return 'CWE-' + matchObj.group()
+    return 'CWE-unknown'
+
+def pmd_cwe(rule):
+    return 'CWE-unknown'
+
+def spotbugs_cwe(rule):
+    if rule.get('relationships'):
+        return 'CWE-' + rule['relationships'][0]['target']['id']
+    return 'CWE-unknown'
+
+def semgrep_cwe(rule):
+    for tag in rule['properties']['tags']:
+        matchObj = re.search(r'CWE-\d+', tag)
+        if matchObj:
+            return matchObj.group()
+    return 'CWE-unknown'
+
+RULE_CWE = {
+    'codeql': codeql_cwe,
+    'pmd': pmd_cwe,
+    'spotbugs': spotbugs_cwe,
+    'semgrep': semgrep_cwe,
+}
+
+def uni_rules(all_rules, tool):
+    rules = load_raw_rule(tool)
     for rule in rules:
-        all_rules['tool'].append('codeql')
+        all_rules['tool'].append(tool)
         all_rules['id'].append(rule['id'])
-        cwe = 'CWE-unknown'
-        for tag in rule['properties']['tags']:
-            matchObj = re.search(r'\d+', tag)
-            if matchObj:
-                cwe = 'CWE-' + matchObj.group()
-                break
-        all_rules['cwe'].append(cwe)
+        all_rules['cwe'].append(RULE_CWE[tool](rule))
+
+def uni_codeql(all_rules):
+    uni_rules(all_rules, 'codeql')
 
 def uni_pmd(all_rules):
-    rules = load_raw_rule('pmd')
-    for rule in rules:
-        all_rules['tool'].append('pmd')
-        all_rules['id'].append(rule['id'])
-        all_rules['cwe'].append('CWE-unknown')
+    uni_rules(all_rules, 'pmd')
 
 def uni_spotbugs(all_rules):
-    rules = load_raw_rule('spotbugs')
-    for rule in rules:
-        all_rules['tool'].append('spotbugs')
-        all_rules['id'].append(rule['id'])
-        cwe = 'CWE-unknown'
-        if rule.get('relationships'):
-            cwe = 'CWE-' + rule['relationships'][0]['target']['id']
-        all_rules['cwe'].append(cwe)
+    uni_rules(all_rules, 'spotbugs')
 
 def uni_semgrep(all_rules):
-    rules = load_raw_rule('semgrep')
-    for rule in rules:
-        all_rules['tool'].append('semgrep')
-        all_rules['id'].append(rule['id'])
-        cwe = 'CWE-unknown'
-        for tag in rule['properties']['tags']:
-            matchObj = re.search(r'CWE-\d+', tag)
-            if matchObj:
-                cwe = matchObj.group()
-                break
-        all_rules['cwe'].append(cwe)
+    uni_rules(all_rules, 'semgrep')
 
 RULE_FUNC = {
     'codeql': uni_codeql,
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+from atomic import atomic_write
+
+CHUNK_SIZE = 1 << 16
+
+# parsed SARIF files are cached here, bump CACHE_VERSION when compact_result changes
+CACHE_DIR = '.cache/sarif'
+CACHE_VERSION = 2
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+# characters that can carry on a number, e.g. 1 | .5 or 1 | e+20 across chunks
+_number_chars = frozenset('0123456789.eE+-')
+
+class JsonStream:
+    """ Reads a JSON document from a file one value at a time """
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        data = self.f.read(size)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def peek(self):
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                raise ValueError('unexpected end of JSON')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer, or cut before its fraction or exponent, may continue in the next chunk
+                cut = end == len(self.buf) or (
+                    isinstance(obj, (int, float)) and not isinstance(obj, bool) and self.buf[end] in _number_chars
+                )
+                if self.eof or not cut:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow geometrically so large values are decoded in linear time
+            self._fill(max(self.chunk_size, len(self.buf) - self.pos))
+
+    """ Pass over a value, it is still decoded in full """
+    def skip(self):
+        self.value()
+
+    """ Yield each key of an object, the caller must consume its value """
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    """ Yield the position of each array element, the caller must consume it """
+    def elements(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+""" Keep only the parts of a result that TraceEntry, its fingerprint and uniform read """
+def compact_result(result: dict):
+    compact = {}
+    if 'ruleId' in result:
+        compact['ruleId'] = result['ruleId']
+    if 'partialFingerprints' in result:
+        compact['partialFingerprints'] = result['partialFingerprints']
+    if 'message' in result:
+        compact['message'] = {}
+        if 'text' in result['message']:
+            compact['message']['text'] = result['message']['text']
+    if 'locations' in result:
+        compact['locations'] = []
+        if result['locations']:
+            location = result['locations'][0]
+            physical = location['physicalLocation']
+            artifact = physical['artifactLocation']
+            compact_physical = {
+                'artifactLocation': {
+                    key: artifact[key] for key in ('uri', 'uriBaseId') if key in artifact
+                }
+            }
+            if 'region' in physical:
+                compact_physical['region'] = physical['region']
+            compact_location = {'physicalLocation': compact_physical}
+            if 'logicalLocation' in location:
+                compact_location['logicalLocation'] = location['logicalLocation']
+            if location.get('logicalLocations'):
+                compact_location['logicalLocations'] = location['logicalLocations'][:1]
+            compact['locations'].append(compact_location)
+    return compact
+
+""" Stream runs[0] of a SARIF file, returns its compact results and its rules """
+def read_sarif(path: str, keep=compact_result):
+    results = None
+    rules = None
+    with open(path, 'r', encoding='UTF-8') as f:
+        stream = JsonStream(f)
+        for key in stream.members():
+            if key != 'runs':
+                stream.skip()
+                continue
+            for i in stream.elements():
+                if i > 0:
+                    stream.skip()
+                    continue
+                for run_key in stream.members():
+                    if run_key == 'results':
+                        results = []
+                        for _ in stream.elements():
+                            results.append(keep(stream.value()))
+                    elif run_key == 'tool':
+                        rules = stream.value()['driver']['rules']
+                    else:
+                        stream.skip()
+    if results is None:
+        raise KeyError('results')
+    if rules is None:
+        raise KeyError('rules')
+    return results, rules
+
+""" Rules of runs[0] of a SARIF file, reading stops once they are found """
+def read_rules(path: str):
+    with open(path, 'r', encoding='UTF-8') as f:
+        stream = JsonStream(f)
+        for key in stream.members():
+            if key != 'runs':
+                stream.skip()
+                continue
+            for _ in stream.elements():
+                for run_key in stream.members():
+                    if run_key == 'tool':
+                        # tool comes before results in the SARIF the tools write, so results are never read
+                        return stream.value()['driver']['rules']
+                    # skip decodes values in full, results one at a time keeps memory bounded
+                    if run_key == 'results':
+                        for _ in stream.elements():
+                            stream.skip()
+                    else:
+                        stream.skip()
+                raise KeyError('rules')
+    raise KeyError('rules')
+
+""" Yield the compact results of runs[0] of a SARIF file one at a time """
+def iter_results(path: str, keep=compact_result):
+    found = False
+    with open(path, 'r', encoding='UTF-8') as f:
+        stream = JsonStream(f)
+        for key in stream.members():
+            if key != 'runs':
+                stream.skip()
+                continue
+            for i in stream.elements():
+                if i > 0:
+                    stream.skip()
+                    continue
+                for run_key in stream.members():
+                    if run_key == 'results':
+                        found = True
+                        for _ in stream.elements():
+                            yield keep(stream.value())
+                    else:
+                        stream.skip()
+    if not found:
+        raise KeyError('results')
+
+def _file_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cache_path(path: str, cache_dir: str, kind: str = 'sarif'):
+    name = hashlib.sha1(os.path.abspath(path).encode('UTF-8')).hexdigest()
+    suffix = '' if kind == 'sarif' else f'.{kind}'
+    return os.path.join(cache_dir, f'{name}{suffix}.pickle')
+
+""" read_sarif backed by an on-disk cache, invalidated when the file changes """
+def load_sarif(path: str, cache_dir: str = CACHE_DIR):
+    return _load_cached(path, cache_dir, read_sarif, 'sarif')
+
+""" read_rules backed by the same cache, without keeping the results """
+def load_rules(path: str, cache_dir: str = CACHE_DIR):
+    return _load_cached(path, cache_dir, read_rules, 'rules')
+
+def _load_cached(path: str, cache_dir: str, read, kind: str):
+    if cache_dir is None:
+        return read(path)
+
+    stat = os.stat(path)
+    cache_path = _cache_path(path, cache_dir, kind)
+    content_hash = None
+    try:
+        with open(cache_path, 'rb') as f:
+            header = pickle.load(f)
+            if header['version'] == CACHE_VERSION and header['size'] == stat.st_size:
+                if header['mtime'] == stat.st_mtime_ns:
+                    return pickle.load(f)
+                # touched but maybe not changed, e.g. after a fresh checkout
+                content_hash = _file_hash(path)
+                if header['hash'] == content_hash:
+                    data = pickle.load(f)
+                    _write_cache(cache_path, stat, content_hash, data)
+                    return data
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+        pass
+
+    data = read(path)
+    if content_hash is None:
+        content_hash = _file_hash(path)
+    _write_cache(cache_path, stat, content_hash, data)
+    return data
+
+def _write_cache(cache_path: str, stat, content_hash: str, data):
+    header = {
+        'version': CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': content_hash,
+    }
+    with atomic_write(cache_path, 'wb') as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
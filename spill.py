@@ -0,0 +1,79 @@
+""" Results of all tags hash-partitioned by artifact URI into files on disk, so matching fits in a memory limit """
+import math
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+SPILL_DIR = '.cache/spill'
+# rough bytes of parsed results per byte of SARIF, used to size partitions
+EXPANSION = 4
+# pickled bytes kept across all partitions before they are written out
+BUFFER_BYTES = 64 * 2 ** 20
+
+""" Number of partitions so that one partition of all tags fits in memory_bytes """
+def partition_count(total_bytes: int, memory_bytes: int):
+    return max(1, math.ceil(total_bytes * EXPANSION / memory_bytes))
+
+""" The URI TraceEntry matches on, every candidate of a trace shares it """
+def result_uri(result: dict):
+    try:
+        artifact = result['locations'][0]['physicalLocation']['artifactLocation']
+    except (KeyError, IndexError):
+        return ''
+    uri = artifact.get('uri', '')
+    if artifact.get('uriBaseId'):
+        uri = artifact['uriBaseId'] + uri
+    return uri
+
+class Partitions:
+    """ Spill files of (tag index, position, result) records, removed on close """
+    def __init__(self, count: int, buffer_bytes: int = BUFFER_BYTES, spill_dir: str = SPILL_DIR):
+        self.count = count
+        self.buffer_bytes = buffer_bytes
+        os.makedirs(spill_dir, exist_ok=True)
+        self.dir = tempfile.mkdtemp(dir=spill_dir)
+        # records are pickled as they come in so the buffered size is known
+        self.buffers = {}
+        self.buffered = 0
+
+    def _path(self, p: int):
+        return os.path.join(self.dir, f'part_{p:05d}.pickle')
+
+    def add(self, tag_index: int, position: int, result: dict):
+        p = zlib.crc32(result_uri(result).encode('UTF-8')) % self.count
+        record = pickle.dumps((tag_index, position, result), protocol=pickle.HIGHEST_PROTOCOL)
+        self.buffers.setdefault(p, bytearray()).extend(record)
+        self.buffered += len(record)
+        if self.buffered >= self.buffer_bytes:
+            self.flush()
+
+    """ Write out what is buffered, one file open at a time, call before reading """
+    def flush(self):
+        for p, buffer in sorted(self.buffers.items()):
+            with open(self._path(p), 'ab') as f:
+                f.write(buffer)
+        self.buffers = {}
+        self.buffered = 0
+
+    """ Records of one partition in the order they were added """
+    def read(self, p: int):
+        if not os.path.exists(self._path(p)):
+            return
+        with open(self._path(p), 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def close(self):
+        self.buffers = {}
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,179 @@
+""" Uniform warnings of every repo and tool in one SQLite database, indexed for ad-hoc queries """
+import argparse
+import json
+import os
+import sqlite3
+from tqdm import tqdm
+
+repos = ['commons-io', 'commons-lang', 'opennlp', 'pdfbox', 'ratis']
+tools = ['codeql', 'pmd', 'spotbugs', 'semgrep']
+
+DB_PATH = 'warnings.db'
+LINE_WINDOW = 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    repo TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (repo, tool)
+);
+CREATE TABLE IF NOT EXISTS warnings (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT,
+    cwe TEXT,
+    message TEXT,
+    file TEXT,
+    file_name TEXT,
+    start_line INTEGER,
+    end_line INTEGER,
+    start_column INTEGER,
+    end_column INTEGER,
+    flag INTEGER
+);
+CREATE TABLE IF NOT EXISTS tag_history (
+    warning_id INTEGER NOT NULL REFERENCES warnings(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    file TEXT,
+    line_number INTEGER,
+    PRIMARY KEY (warning_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS warnings_repo_tool ON warnings (repo, tool, position);
+CREATE INDEX IF NOT EXISTS warnings_cwe ON warnings (cwe, repo);
+CREATE INDEX IF NOT EXISTS warnings_file_line ON warnings (repo, file_name, start_line);
+'''
+
+WARNING_COLUMNS = ('type', 'cwe', 'message', 'file', 'start_line', 'end_line', 'start_column', 'end_column', 'flag')
+
+def connect(path: str = DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+def file_name(path: str):
+    return path.split('/')[-1]
+
+def _stamp(path: str):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+""" Replace the warnings of a repo and tool with those of a uniform report """
+def ingest(conn, repo: str, tool: str, report: list, source=None):
+    with conn:
+        conn.execute('DELETE FROM warnings WHERE repo = ? AND tool = ?', (repo, tool))
+        for position, warning in enumerate(report):
+            cursor = conn.execute(
+                'INSERT INTO warnings (repo, tool, position, type, cwe, message, file, file_name, '
+                'start_line, end_line, start_column, end_column, flag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    repo, tool, position, warning['type'], warning['cwe'], warning['message'],
+                    warning['file'], file_name(warning['file']), warning['start_line'], warning['end_line'],
+                    warning['start_column'], warning['end_column'], int(warning['flag']),
+                ),
+            )
+            conn.executemany(
+                'INSERT INTO tag_history (warning_id, position, file, line_number) VALUES (?, ?, ?, ?)',
+                [(cursor.lastrowid, i, trace['file'], trace['line_number']) for i, trace in enumerate(warning['tag_history'])],
+            )
+        if source is not None:
+            conn.execute(
+                'INSERT OR REPLACE INTO sources (repo, tool, path, size, mtime) VALUES (?, ?, ?, ?, ?)',
+                (repo, tool, source, *_stamp(source)),
+            )
+
+""" Load reports/{tool}/{repo}/warnings.json unless the same file was already loaded, returns whether it was """
+def ingest_report(conn, repo: str, tool: str, force: bool = False):
+    path = f'reports/{tool}/{repo}/warnings.json'
+    row = conn.execute('SELECT size, mtime FROM sources WHERE repo = ? AND tool = ?', (repo, tool)).fetchone()
+    if not force and row is not None and tuple(row) == _stamp(path):
+        return False
+    with open(path, 'r') as f:
+        ingest(conn, repo, tool, json.load(f), path)
+    return True
+
+""" Warnings of a repo and tool as dicts in report order, the same as its warnings.json """
+def get_report(conn, repo: str, tool: str):
+    rows = conn.execute(
+        f'SELECT id, {", ".join(WARNING_COLUMNS)} FROM warnings WHERE repo = ? AND tool = ? ORDER BY position',
+        (repo, tool),
+    ).fetchall()
+    history = {}
+    for warning_id, file, line_number in conn.execute(
+        'SELECT h.warning_id, h.file, h.line_number FROM tag_history h JOIN warnings w ON w.id = h.warning_id '
+        'WHERE w.repo = ? AND w.tool = ? ORDER BY h.warning_id, h.position',
+        (repo, tool),
+    ):
+        history.setdefault(warning_id, []).append({'file': file, 'line_number': line_number})
+    report = []
+    for row in rows:
+        warning = {column: row[column] for column in WARNING_COLUMNS}
+        warning['flag'] = bool(warning['flag'])
+        warning['tag_history'] = history.get(row['id'], [])
+        report.append(warning)
+    return report
+
+""" Warnings matching every given filter, path is a substring of the file """
+def query(conn, repo=None, tool=None, cwe=None, path=None, file=None, line=None, window: int = LINE_WINDOW):
+    conditions, params = [], []
+    for column, value in (('repo', repo), ('tool', tool), ('cwe', cwe), ('file_name', file and file_name(file))):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if path is not None:
+        conditions.append("instr(file, ?) > 0")
+        params.append(path)
+    if line is not None:
+        conditions.append('start_line > ? AND start_line < ?')
+        params += [line - window, line + window]
+    where = ' AND '.join(conditions) or '1'
+    return conn.execute(f'SELECT * FROM warnings WHERE {where} ORDER BY repo, tool, position', params).fetchall()
+
+""" Pairs of warnings of different tools in the same file within window lines, as merge.py counts them """
+def agreeing(conn, repo: str, cwe=None, path=None, window: int = LINE_WINDOW):
+    conditions, params = ['a.repo = ?'], [repo]
+    if cwe is not None:
+        conditions.append('a.cwe = ? AND b.cwe = ?')
+        params += [cwe, cwe]
+    if path is not None:
+        conditions.append('instr(a.file, ?) > 0 AND instr(b.file, ?) > 0')
+        params += [path, path]
+    return conn.execute(
+        'SELECT a.id AS a_id, a.tool AS a_tool, b.id AS b_id, b.tool AS b_tool, a.file_name, '
+        'a.start_line AS a_line, b.start_line AS b_line, a.cwe AS a_cwe, b.cwe AS b_cwe '
+        'FROM warnings a JOIN warnings b '
+        'ON b.repo = a.repo AND b.file_name = a.file_name '
+        'AND b.start_line > a.start_line - ? AND b.start_line < a.start_line + ? AND b.tool > a.tool '
+        f'WHERE {" AND ".join(conditions)} ORDER BY a.file_name, a.start_line',
+        [window, window] + params,
+    ).fetchall()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--force', action='store_true', help='reload reports even if they did not change')
+    parser.add_argument('--repo', help='query: only this repo')
+    parser.add_argument('--tool', help='query: only this tool')
+    parser.add_argument('--cwe', help='query: only this CWE, e.g. CWE-404')
+    parser.add_argument('--path', help='query: only files whose path contains this, e.g. src/main/')
+    parser.add_argument('--agree', type=int, metavar='LINES', help='query: pairs of tools within LINES lines in the same file of --repo')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    if not any((args.repo, args.tool, args.cwe, args.path, args.agree)):
+        jobs = [(repo, tool) for repo in repos for tool in tools if os.path.exists(f'reports/{tool}/{repo}/warnings.json')]
+        loaded = sum(ingest_report(conn, repo, tool, args.force) for repo, tool in tqdm(jobs, desc='Loading reports'))
+        count = conn.execute('SELECT count(*) FROM warnings').fetchone()[0]
+        print(f'Loaded {loaded} of {len(jobs)} reports, {count} warnings in {args.db}')
+    elif args.agree is not None:
+        for row in agreeing(conn, args.repo, args.cwe, args.path, args.agree):
+            print(json.dumps(dict(row)))
+    else:
+        for row in query(conn, args.repo, args.tool, args.cwe, args.path):
+            print(json.dumps(dict(row)))
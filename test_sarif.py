@@ -0,0 +1,37 @@
+import io
+import json
+import pytest
+from sarif import JsonStream
+
+def read_array(text, chunk_size):
+    stream = JsonStream(io.StringIO(text), chunk_size)
+    return [stream.value() for _ in stream.elements()]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 7])
+@pytest.mark.parametrize('text', [
+    '[1e+20, 2]',
+    '[1.5, 2]',
+    '[-12.25E-3,4]',
+    '[10, 200, 3000]',
+    '[1.0e5]',
+    '[true, false, null, -0]',
+    '["a\\"b", {"k": [1.5, "x"]}, 2E2]',
+])
+def test_values_split_across_chunks(text, chunk_size):
+    assert read_array(text, chunk_size) == json.loads(text)
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64])
+def test_members_and_skip(chunk_size):
+    text = '{"version": 2.10, "runs": [{"results": [{"a": 1e3}, {"b": [2.5]}]}], "tail": -1}'
+    stream = JsonStream(io.StringIO(text), chunk_size)
+    seen = {}
+    for key in stream.members():
+        if key == 'runs':
+            stream.skip()
+        else:
+            seen[key] = stream.value()
+    assert seen == {'version': 2.1, 'tail': -1}
+
+def test_truncated_document():
+    with pytest.raises(ValueError):
+        read_array('[1.5, 2', 3)
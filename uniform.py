@@ -34,47 +34,69 @@ class Warning:
         self.flag = flag
         self.tag_history = tag_history
 
-def uniform(warnings, tool, rules):
+""" Map each rule id to its CWE, leaving out rules without any data """
+def rule_cwes(rules):
+    cwes = {}
+    known = set()
+    empty = rules.isnull().all(axis=1)
+    for rule_id, cwe, is_empty in zip(rules.index, rules['cwe'], empty):
+        if rule_id not in cwes:
+            cwes[rule_id] = cwe
+        if not is_empty:
+            known.add(rule_id)
+    return {rule_id: cwe for rule_id, cwe in cwes.items() if rule_id in known}
+
+""" Uniform one warning using a prebuilt rule_cwes map, None if its rule is unknown """
+def uniform_warning(warning, tool, cwes):
+    trace_base = warning.trace[0]
+
+    rule_id = trace_base.data['ruleId']
+    if rule_id not in cwes:
+        return None
+
+    wtype = rule_id
+    cwe = cwes[rule_id]
+    message = trace_base.message()
+    file = trace_base.uri()
+    start_line = trace_base.start_line()
+    end_line = trace_base.end_line()
+    start_column = trace_base.start_column()
+    end_column = trace_base.end_column()
+    flag = False
+    tag_history = [
+        Trace(
+            trace.uri(),
+            trace.start_line()
+        ) for trace in warning.trace[1:]
+    ]
+
+    return Warning(
+        wtype,
+        cwe,
+        message,
+        file,
+        start_line,
+        end_line,
+        start_column,
+        end_column,
+        flag,
+        tag_history
+    )
+
+""" Uniform warnings using a prebuilt rule_cwes map, returns them and the number dropped for unknown rules """
+def uniform_warnings(warnings, tool, cwes):
     uni_warnings = []
+    dropped = 0
     for warning in warnings:
-        trace_base = warning.trace[0]
-
-        rule_id = trace_base.data['ruleId']
-        try:
-            rule = rules.loc[[rule_id]]
-        except KeyError:
-            continue
-        if rule.isnull().values.all():
+        uni_warning = uniform_warning(warning, tool, cwes)
+        if uni_warning is None:
+            dropped += 1
             continue
+        uni_warnings.append(uni_warning)
+    return uni_warnings, dropped
 
-        wtype = rule_id
-        cwe = rule['cwe'].values[0]
-        message = trace_base.message()
-        file = trace_base.uri()
-        start_line = trace_base.start_line()
-        end_line = trace_base.end_line()
-        start_column = trace_base.start_column()
-        end_column = trace_base.end_column()
-        flag = False
-        tag_history = [
-            Trace(
-                trace.uri(),
-                trace.start_line()
-            ) for trace in warning.trace[1:]
-        ]
-
-        uni_warnings.append(Warning(
-            wtype,
-            cwe,
-            message,
-            file,
-            start_line,
-            end_line,
-            start_column,
-            end_column,
-            flag,
-            tag_history
-        ))
+def uniform(warnings, tool, rules):
+    uni_warnings, _ = uniform_warnings(warnings, tool, rule_cwes(rules))
     return uni_warnings
 
 import json
@@ -85,4 +107,42 @@ class Encoder(json.JSONEncoder):
             return obj.__dict__
         if isinstance(obj, Warning):
             return obj.__dict__
-        return json.JSONEncoder.default(self, obj)
\ No newline at end of file
+        return json.JSONEncoder.default(self, obj)
+
+class JsonArrayWriter:
+    """ Writes a JSON array one item at a time, indented output is the same as json.dump """
+    def __init__(self, f, indent=2, cls=Encoder):
+        self.f = f
+        self.indent = indent
+        self.first = True
+        if indent is None:
+            # compact: one item per line so readers can follow the file as it grows
+            self.encoder = cls(separators=(',', ':'))
+        else:
+            self.encoder = cls(indent=indent)
+        self.f.write('[')
+
+    def write(self, obj):
+        text = self.encoder.encode(obj)
+        if self.indent is not None:
+            prefix = ' ' * self.indent
+            # nest the item one level deeper, strings never contain a raw newline
+            text = prefix + text.replace('\n', '\n' + prefix)
+        self.f.write('\n' if self.first else ',\n')
+        self.f.write(text)
+        self.f.flush()
+        self.first = False
+
+    def close(self):
+        if not self.first:
+            self.f.write('\n')
+        self.f.write(']')
+        self.f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # leave the array open on an error so a partial file never parses as a complete report
+        if exc_type is None:
+            self.close()
@@ -1,90 +1,160 @@
+import re
+import sys
+
+LINE_WINDOW = 100
+
+_NUMBERS = re.compile(r'\d+')
+_SPACES = re.compile(r'\s+')
+# fingerprint not computed yet, None is a valid fingerprint
+_UNSET = object()
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
 class TraceEntry:
+    __slots__ = (
+        'data',
+        '_start_line',
+        '_end_line',
+        '_start_column',
+        '_end_column',
+        '_name',
+        '_kind',
+        '_fully_qualified_name',
+        '_uri',
+        '_message',
+        '_key',
+        '_hash',
+        '_fingerprint',
+    )
+
     def __init__(
         self,
         data: dict
     ):
         self.data = data
-    
-    def _region(self):
-        if self.data['locations'][0]['physicalLocation'].get('region'):
-            return self.data['locations'][0]['physicalLocation']['region']
-        return None
-    def _logical(self):
-        if self.data['locations'][0].get('logicalLocation'):
-            return self.data['locations'][0]['logicalLocation']
-        return None
-    def _artifact(self):
-        return self.data['locations'][0]['physicalLocation']['artifactLocation']
-    
+
+        location = data['locations'][0]
+        physical = location['physicalLocation']
+        region = physical.get('region')
+        if region:
+            self._start_line = region['startLine']
+            self._end_line = region['startLine']
+            self._start_column = region.get('startColumn')
+            self._end_column = region.get('endColumn')
+        else:
+            self._start_line = 0
+            self._end_line = 0
+            self._start_column = 0
+            self._end_column = 0
+
+        logical = location.get('logicalLocation')
+        if logical:
+            self._name = _intern(logical.get('name'))
+            self._kind = _intern(logical.get('kind'))
+            self._fully_qualified_name = _intern(logical.get('fullyQualifiedName'))
+        else:
+            self._name = ""
+            self._kind = ""
+            self._fully_qualified_name = ""
+
+        artifact = physical['artifactLocation']
+        uri = artifact['uri']
+        if artifact.get('uriBaseId'):
+            uri = artifact['uriBaseId'] + uri
+        self._uri = _intern(uri)
+        self._message = _intern(data['message'].get('text'))
+
+        self._key = (
+            self._start_column,
+            self._end_column,
+            self._uri,
+            self._message,
+            self._name,
+            self._kind,
+            self._fully_qualified_name,
+        )
+        self._hash = hash(self._key)
+        self._fingerprint = _UNSET
+
     def start_line(self):
-        if self._region():
-            return self._region()['startLine']
-        return 0
+        return self._start_line
     
     def end_line(self):
-        if self._region():
-            return self._region()['startLine']
-        return 0
+        return self._end_line
     
     def start_column(self):
-        if self._region():
-            return self._region().get('startColumn')
-        return 0
+        return self._start_column
     
     def end_column(self):
-        if self._region():
-            return self._region().get('endColumn')
-        return 0
+        return self._end_column
     
     def name(self):
-        if self._logical():
-            return self._logical().get('name')
-        return ""
+        return self._name
     
     def kind(self):
-        if self._logical():
-            return self._logical().get('kind')
-        return ""
+        return self._kind
     
     def fullyQualifiedName(self):
-        if self._logical():
-            return self._logical().get('fullyQualifiedName')
-        return ""
+        return self._fully_qualified_name
     
     def uri(self):
-        uri = self._artifact()['uri']
-        if self._artifact().get('uriBaseId'):
-            uri = self._artifact()['uriBaseId'] + uri
-        return uri
+        return self._uri
     
     def message(self):
-        return self.data['message'].get('text')
+        return self._message
     
     def rule_id(self):
         return self.data['ruleId']
     
-    
+    """ Fields that must match exactly for two traces to be the same warning """
+    def match_key(self):
+        return self._key
 
     def __eq__(self, other):
-        if abs(self.start_line() - other.start_line()) < 100 and\
-            abs(self.end_line() - other.end_line()) < 100 and\
-            self.start_column() == other.start_column() and\
-            self.end_column() == other.end_column() and\
-            self.uri() == other.uri() and\
-            self.message() == other.message() and\
-            self.name() == other.name() and\
-            self.kind() == other.kind() and\
-            self.fullyQualifiedName() == other.fullyQualifiedName():
-            return True
-        return False
+        return self._key == other._key and\
+            abs(self._start_line - other._start_line) < LINE_WINDOW and\
+            abs(self._end_line - other._end_line) < LINE_WINDOW
+
+    """ Stable identity of the warning across tags, None if the result has nothing to build one from """
+    def fingerprint(self):
+        if self._fingerprint is _UNSET:
+            self._fingerprint = fingerprint(self.data, self._uri, self._message)
+        return self._fingerprint
+
+    """ Traces that are equal share a match key, so hashing ignores the line """
+    def __hash__(self):
+        return self._hash
     
 
+""" CodeQL's line hash, otherwise the rule, logical location and message with numbers and spacing normalised """
+def fingerprint(data: dict, uri: str, message: str):
+    rule = data.get('ruleId')
+    line_hash = data.get('partialFingerprints', {}).get('primaryLocationLineHash')
+    if line_hash:
+        return (rule, uri, line_hash)
+    location = data['locations'][0]
+    logical = location.get('logicalLocation')
+    if not logical and location.get('logicalLocations'):
+        logical = location['logicalLocations'][0]
+    if not logical:
+        return None
+    name = logical.get('fullyQualifiedName') or logical.get('name')
+    if not name:
+        return None
+    message = _SPACES.sub(' ', _NUMBERS.sub('#', message or '')).strip().lower()
+    return (rule, uri, name, message)
+
 class Warning:
     def __init__(
         self,
         trace_base: TraceEntry,
     ):
         self.trace = [trace_base]
+        # the last trace is the k-th result with its fingerprint in its tag
+        self.occurrence = 0
     
     def try_add_trace(self, result: dict):
         last_trace = self.trace[-1]
@@ -94,5 +164,8 @@ class Warning:
             self.trace.append(toAdd)
         return same
 
+    def add_trace(self, result: dict):
+        self.trace.append(TraceEntry(result))
+
 def to_warning(result: dict):
     return Warning(TraceEntry(result))
\ No newline at end of file